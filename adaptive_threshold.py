@@ -0,0 +1,57 @@
+import statistics
+from dataclasses import dataclass, field
+
+
+@dataclass
+class AdaptiveThreshold:
+    """
+    A clap threshold that follows the background noise: ``median + k * MAD`` of the Laplacian output, sampled once
+    per frame.
+
+    The first ``warmup_frames`` values seed the median and the median absolute deviation exactly. After that both are
+    tracked with the stochastic-approximation quantile update, stepping towards each new value by ``rate`` times the
+    current spread, so each frame costs O(1) and occasional claps barely move either estimate.
+    """
+    k: float = 8
+    rate: float = 0.005
+    minimum: float = 0
+    warmup_frames: int = 10
+
+    median: float = 0
+    mad: float = 0
+    warmup_values: list[float] = field(default_factory=list, repr=False)
+    # set when restored from a saved profile, skipping the warmup
+    seeded: bool = False
+
+    @property
+    def ready(self) -> bool:
+        return self.seeded or len(self.warmup_values) >= self.warmup_frames
+
+    def seed(self, median: float, mad: float):
+        self.median = median
+        self.mad = mad
+        self.seeded = True
+
+    @property
+    def threshold(self) -> float:
+        return max(self.median + self.k * self.mad, self.minimum)
+
+    def update(self, value: float):
+        if not self.ready:
+            self.warmup_values.append(value)
+            if self.ready:
+                self.median = statistics.median(self.warmup_values)
+                self.mad = statistics.median(abs(x - self.median) for x in self.warmup_values)
+            return
+
+        step = self.rate * max(self.mad, 1e-6 * abs(self.median), 1e-9)
+        if value > self.median:
+            self.median += step
+        elif value < self.median:
+            self.median -= step
+
+        # the 0.5 quantile of |value - median| is the MAD
+        if abs(value - self.median) > self.mad:
+            self.mad += step
+        else:
+            self.mad = max(self.mad - step, 0)
@@ -0,0 +1,118 @@
+import threading
+import time
+import wave
+from dataclasses import dataclass
+from pathlib import Path
+from queue import Queue
+from typing import Optional
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    label: str
+    # in samples (per channel) since the recorder started
+    start: int
+    event: int
+    end: int
+
+
+class RingRecorder:
+    """
+    Keeps the last ``seconds`` of raw int16 audio in a preallocated ring buffer, and dumps a window of
+    ``before`` + ``after`` seconds around clap or manual triggers to ``directory``.
+
+    ``write`` runs on the capture thread and only copies samples; a snapshot is copied out once its window has been
+    captured, and written as a WAV file by a background thread. Next to each WAV, a ``.claps`` sidecar holds the event
+    time in seconds from the start of the file.
+    """
+
+    def __init__(self, directory: str = 'recordings', seconds: float = 10, before: float = 1, after: float = 1):
+        if before + after > seconds:
+            raise ValueError('snapshot window is longer than the ring buffer')
+
+        self.directory = Path(directory)
+        self.seconds = seconds
+        self.before = before
+        self.after = after
+
+        self.sample_rate: Optional[int] = None
+        self.channels = 1
+        self.buffer: Optional[np.ndarray] = None
+        self.written = 0
+
+        self.lock = threading.Lock()
+        self.pending: list[Snapshot] = []
+        self.write_queue: Queue[Optional[tuple[Snapshot, np.ndarray]]] = Queue()
+        self.writer: Optional[threading.Thread] = None
+
+    def start(self, sample_rate: int, channels: int = 1):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.buffer = np.zeros((int(self.seconds * sample_rate), channels), dtype=np.int16)
+        self.written = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.write_snapshots, daemon=True)
+            self.writer.start()
+
+    def write(self, chunk: np.ndarray):
+        frames = chunk.reshape(-1, self.channels)
+        capacity = self.buffer.shape[0]
+        position = self.written % capacity
+        first = min(frames.shape[0], capacity - position)
+        self.buffer[position:position + first] = frames[:first]
+        self.buffer[:frames.shape[0] - first] = frames[first:]
+        self.written += frames.shape[0]
+
+        if self.pending:
+            with self.lock:
+                ready = [snapshot for snapshot in self.pending if snapshot.end <= self.written]
+                self.pending = [snapshot for snapshot in self.pending if snapshot.end > self.written]
+            for snapshot in ready:
+                self.write_queue.put((snapshot, self.extract(snapshot.start, snapshot.end)))
+
+    def extract(self, start: int, end: int) -> np.ndarray:
+        capacity = self.buffer.shape[0]
+        start = max(start, self.written - capacity, 0)
+        indices = np.arange(start, end) % capacity
+        return self.buffer[indices]
+
+    def trigger(self, label: str = 'manual', at_sample: Optional[int] = None):
+        """
+        Dump the window around ``at_sample`` (by default, now) once the audio after it has been captured.
+        """
+        event = self.written if at_sample is None else max(at_sample, 0)
+        snapshot = Snapshot(
+            label,
+            max(event - int(self.before * self.sample_rate), 0),
+            event,
+            event + int(self.after * self.sample_rate)
+        )
+        with self.lock:
+            self.pending.append(snapshot)
+
+    def write_snapshots(self):
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                return
+            snapshot, audio = item
+
+            name = f'{time.strftime("%Y%m%d-%H%M%S")}-{snapshot.label}-{snapshot.event}'
+            with wave.open(str(self.directory / f'{name}.wav'), 'wb') as wav:
+                wav.setnchannels(self.channels)
+                wav.setsampwidth(2)
+                wav.setframerate(self.sample_rate)
+                wav.writeframes(audio.tobytes())
+            if snapshot.label == 'clap':
+                event_seconds = (snapshot.event - snapshot.start) / self.sample_rate
+                (self.directory / f'{name}.claps').write_text(f'{event_seconds}\n')
+
+    def close(self):
+        self.write_queue.put(None)
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
@@ -0,0 +1,391 @@
+#!/usr/bin/python3
+import asyncio
+import dataclasses
+import json
+import platform
+import subprocess
+import sys
+import time
+import wave
+from pathlib import Path
+from typing import Optional, Callable, Any
+
+import fire
+import numpy as np
+
+from calibrate import Calibrator
+from clap_detector import ClapDetector
+from clap_kernel import KERNEL_AVAILABLE, detect_claps, detect_claps_python
+from constants import CHUNK
+from fft_backend import FFT_BACKENDS, make_fft_backend
+from fsm import grammar, regular_expressions as rex
+from fsm.bit_parallel import BitParallelMachine
+from fsm.actions import Action
+from fsm.deterministic_finite_state_machine import DFSMachine
+from fsm.events import Wait
+from fsm.notifier import Notifier
+from settings import Settings, default_settings
+
+SAMPLE_RATE = 44100
+DEFAULT_BASELINE = Path(__file__).parent / 'benchmark_baseline.json'
+# the modules each main.py subcommand imports when it runs
+STARTUP_IMPORTS = {
+    'cli': [],
+    'clappy': ['clap_program', 'clap_sequence_regex', 'audio_recorder', 'metrics'],
+    'websocket': ['websocket_listener'],
+    'calibrate': ['calibrate'],
+    'relay': ['relay_server'],
+    'daemon': ['clap_program', 'runtime', 'websocket_listener', 'metrics'],
+}
+
+
+def synthetic_chunks(frame_count: int, clap_frames: list[int], *, seed: int = 0,
+                     sample_rate: int = SAMPLE_RATE) -> list[np.ndarray]:
+    """
+    Deterministic int16 fixture: quiet background noise plus a short decaying broadband burst starting at each of
+    ``clap_frames``.
+    """
+    rng = np.random.default_rng(seed)
+    audio = rng.normal(0, 60, frame_count * CHUNK)
+
+    burst_length = int(0.05 * sample_rate)
+    envelope = np.exp(-np.arange(burst_length) / (0.008 * sample_rate))
+    for clap_frame in clap_frames:
+        start = clap_frame * CHUNK + CHUNK // 4
+        end = min(start + burst_length, audio.size)
+        audio[start:end] += rng.normal(0, 12000, end - start) * envelope[:end - start]
+
+    audio = np.clip(audio, np.iinfo(np.int16).min, np.iinfo(np.int16).max).astype(np.int16)
+    return list(audio.reshape(frame_count, CHUNK))
+
+
+def load_fixture(path: str) -> tuple[list[np.ndarray], int]:
+    """
+    Load a recorded mono int16 fixture, either a WAV file or headerless samples at ``SAMPLE_RATE``.
+    """
+    if path.endswith('.wav'):
+        with wave.open(path, 'rb') as wav:
+            sample_rate = wav.getframerate()
+            audio = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+    else:
+        sample_rate = SAMPLE_RATE
+        audio = np.fromfile(path, dtype=np.int16)
+
+    frame_count = audio.size // CHUNK
+    return list(audio[:frame_count * CHUNK].reshape(frame_count, CHUNK)), sample_rate
+
+
+def new_detector(on_clap: Callable[[int], Any], sample_rate: int, settings: Settings = default_settings,
+                 **kwargs) -> ClapDetector:
+    detector = ClapDetector(on_clap, settings=settings, **kwargs)
+    detector.sample_rate = sample_rate
+    detector.allocate_history()
+    return detector
+
+
+def bench_record_frame(chunks: list[np.ndarray], sample_rate: int) -> dict[str, float]:
+    detector = new_detector(lambda clap_frame_number: None, sample_rate)
+
+    timings = np.empty(len(chunks))
+    for i, chunk in enumerate(chunks):
+        start = time.perf_counter()
+        detector.record_chunk(chunk)
+        detector.process_frame()
+        timings[i] = time.perf_counter() - start
+
+    return {
+        'dsp_ms_per_chunk_median': float(np.median(timings) * 1000),
+        'dsp_ms_per_chunk_p99': float(np.percentile(timings, 99) * 1000),
+    }
+
+
+def bench_fft_backends(chunks: list[np.ndarray], sample_rate: int) -> dict[str, float]:
+    results = {}
+    for name in FFT_BACKENDS:
+        for float32 in (False, True):
+            try:
+                fft = make_fft_backend(name, float32=float32)
+            except ImportError:
+                continue
+            detector = new_detector(lambda clap_frame_number: None, sample_rate, fft=fft)
+            timings = np.empty(len(chunks))
+            for i, chunk in enumerate(chunks):
+                start = time.perf_counter()
+                detector.record_chunk(chunk)
+                timings[i] = time.perf_counter() - start
+            results[f'record_ms_{name}{"_float32" if float32 else ""}'] = float(np.median(timings) * 1000)
+    return results
+
+
+def bench_listen(chunks: list[np.ndarray], sample_rate: int, clap_frames: list[int]) -> dict[str, float]:
+    detection_frames = []
+    detector = new_detector(lambda clap_frame_number: detection_frames.append(detector.frame_count), sample_rate)
+
+    start = time.process_time()
+    detector.listen(iter(chunks))
+    cpu_seconds = time.process_time() - start
+
+    results = {
+        'frames_per_cpu_second': len(chunks) / max(cpu_seconds, 1e-9),
+        'realtime_factor': len(chunks) * CHUNK / sample_rate / max(cpu_seconds, 1e-9),
+        'claps_detected': len(detection_frames),
+    }
+    if clap_frames and detection_frames:
+        delays = [
+            min((frame - clap_frame for frame in detection_frames if frame >= clap_frame), default=np.nan)
+            for clap_frame in clap_frames
+        ]
+        results['detection_delay_seconds'] = float(np.nanmean(delays) * CHUNK / sample_rate)
+    return results
+
+
+def labelled_windows(chunks: list[np.ndarray], clap_frames: list[int], window_frames: int):
+    for start in range(0, len(chunks) - window_frames + 1, window_frames):
+        contains_clap = any(start <= clap_frame < start + window_frames - 4 for clap_frame in clap_frames)
+        yield chunks[start:start + window_frames], contains_clap
+
+
+def bench_calibration(chunks: list[np.ndarray], sample_rate: int, clap_frames: list[int], *,
+                      depth: int, grid_size: int) -> dict[str, float]:
+    calibrator = Calibrator()
+    calibrator.capturing_clap_detector.sample_rate = sample_rate
+    for window, contains_clap in labelled_windows(chunks, clap_frames, window_frames=20):
+        calibrator.labelled_chunks.add_window(np.stack(window), contains_clap)
+
+    start = time.perf_counter()
+    calibrator.score_settings(default_settings)
+    score_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    calibrator.calibrate(depth=depth, grid_size=grid_size)
+    calibrate_seconds = time.perf_counter() - start
+
+    return {
+        'score_settings_seconds': score_seconds,
+        'calibrate_seconds': calibrate_seconds,
+    }
+
+
+class RecordTime(Action):
+    def __init__(self, times: list[float]):
+        self.times = times
+
+    async def run(self):
+        self.times.append(time.perf_counter())
+
+
+def gesture_regex(clap_notifier: Notifier, action: Action) -> rex.RegularExpression:
+    """
+    A grammar shaped like ``main.ClapProgram``'s: three two-clap prefixes, each followed by repeated claps.
+    """
+    timeout = 2
+    long_clap_delay = 0.75
+
+    def wait(t):
+        return rex.Event(Wait(t))
+
+    def clap(actions=frozenset()):
+        return clap_notifier.event_re(actions)
+
+    def gap(ev):
+        return ev | wait(long_clap_delay) >> wait(timeout - long_clap_delay)
+
+    gestures = [
+        clap() >> gap(clap() >> gap(rex.Some(clap({action})) >> wait(timeout)))
+        for _ in range(3)
+    ]
+    return rex.Many(rex.Or(gestures))
+
+
+# gesture_regex, as a gesture grammar
+GESTURE_GRAMMAR = '''
+wait timeout 2
+wait long 0.75
+gesture = .s.s(.{action})+_
+main = ($gesture | $gesture | $gesture)*
+'''
+
+
+def bench_fsm(repeats: int) -> dict[str, float]:
+    """
+    Building and running the gestures with each engine: determinized, loaded from compiled tables, and as a
+    bit-parallel NFA.
+    """
+    async def run():
+        clap_notifier = Notifier('clap')
+        action_times: list[float] = []
+        action = RecordTime(action_times)
+        regex = gesture_regex(clap_notifier, action)
+
+        def build_ms(build: Callable[[], Any]) -> float:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                build()
+            return (time.perf_counter() - start) / repeats * 1000
+
+        async def action_latency_ms(machine) -> float:
+            action_times.clear()
+            machine_task = asyncio.create_task(machine.run())
+            await asyncio.sleep(0)
+
+            latencies = []
+            for _ in range(repeats):
+                notify_time = time.perf_counter()
+                await clap_notifier.notify()
+                if len(action_times) > len(latencies):
+                    latencies.append(action_times[-1] - notify_time)
+
+            machine_task.cancel()
+            return float(np.median(latencies) * 1000) if latencies else float('nan')
+
+        # the same gestures, compiled ahead of time
+        tables = grammar.compile_grammar(GESTURE_GRAMMAR)
+        clap = clap_notifier.event()
+        nfa = BitParallelMachine.from_regular_expression(regex)
+        return {
+            'fsm_build_ms': build_ms(lambda: DFSMachine.from_regular_expression(regex)),
+            'fsm_load_tables_ms': build_ms(lambda: DFSMachine.from_tables(tables, 'main', {'clap': clap},
+                                                                          {'action': {action}})),
+            'fsm_nfa_build_ms': build_ms(lambda: BitParallelMachine.from_regular_expression(regex)),
+            'fsm_action_latency_ms': await action_latency_ms(DFSMachine.from_regular_expression(regex)),
+            'fsm_nfa_action_latency_ms': await action_latency_ms(nfa),
+            'fsm_nfa_step_us': build_ms(lambda: nfa.step(nfa.start, nfa.event_indices[clap])) * 1000,
+        }
+
+    return asyncio.run(run())
+
+
+def bench_startup(repeats: int) -> dict[str, float]:
+    """
+    Time to import main.py plus the modules each subcommand loads, in a fresh interpreter, less the time to start a
+    bare interpreter. Takes the best of ``repeats`` runs, as the rest is mostly disk cache noise.
+    """
+    def best_of(code: str) -> float:
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], check=True, cwd=Path(__file__).parent)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    interpreter = best_of('pass')
+    results = {}
+    for command, modules in STARTUP_IMPORTS.items():
+        code = '; '.join(f'import {module}' for module in ['main', *modules])
+        results[f'startup_{command}_ms'] = (best_of(code) - interpreter) * 1000
+    return results
+
+
+KERNEL_CHECK_SETTINGS = (
+    default_settings,
+    dataclasses.replace(default_settings, threshold='auto'),
+    Settings(clap_freq_index=900, threshold=2000, gaussian_laplace_sigma=2.5, freq_gaussian_sigma=40),
+)
+
+
+def frame_claps(chunks: list[np.ndarray], settings: Settings) -> tuple[list[int], Settings]:
+    """
+    The clap frames the per-frame NumPy path finds, and the settings it ends with.
+    """
+    found = []
+    detector = new_detector(found.append, SAMPLE_RATE, settings)
+    for chunk in chunks:
+        detector.record_chunk(chunk)
+        detector.process_frame()
+    return found, detector.settings
+
+
+def kernel_claps(chunks: list[np.ndarray], settings: Settings, kernel: Callable,
+                 block_count: int = 1) -> tuple[list[int], Settings]:
+    """
+    As ``frame_claps``, with ``kernel`` fed the chunks in ``block_count`` blocks.
+    """
+    found = []
+    detector = new_detector(found.append, SAMPLE_RATE, settings)
+    for block in np.array_split(np.arange(len(chunks)), block_count):
+        detector.process_amplitudes(detector.chunk_amplitudes([chunks[i] for i in block]), kernel=kernel)
+    return found, detector.settings
+
+
+def check_kernel(frames: int = 400) -> bool:
+    """
+    Check that the clap kernel, compiled if numba is installed and always uncompiled, finds exactly the clap frames
+    the per-frame NumPy path does, including when a stream is fed to it in several blocks.
+    """
+    chunks = synthetic_chunks(frames, list(range(15, frames - 10, 23)))
+    kernels = {'python': detect_claps_python} | ({'numba': detect_claps} if KERNEL_AVAILABLE else {})
+
+    all_match = True
+    for settings in KERNEL_CHECK_SETTINGS:
+        expected = frame_claps(chunks, settings)
+        for name, kernel in kernels.items():
+            for block_count in (1, 3):
+                found = kernel_claps(chunks, settings, kernel, block_count)
+                match = found == expected
+                all_match &= match
+                print(f'{name:6} kernel, {block_count} block(s), {settings}: {"ok" if match else "MISMATCH"}'
+                      f' ({len(found[0])} claps, expected {len(expected[0])})')
+    return all_match
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], tolerance: float):
+    # metrics where a bigger number is an improvement
+    higher_is_better = {'frames_per_cpu_second', 'realtime_factor'}
+
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline or not baseline[name] or name == 'claps_detected':
+            continue
+        ratio = value / baseline[name]
+        worse = ratio < 1 - tolerance if name in higher_is_better else ratio > 1 + tolerance
+        print(f'{name:32} {baseline[name]:12.4g} -> {value:12.4g}  ({ratio:5.2f}x){"  REGRESSION" if worse else ""}')
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def run(fixture: Optional[str] = None, *, frames: int = 400, calibration_depth: int = 1, calibration_grid: int = 2,
+        fsm_repeats: int = 50, startup_repeats: int = 5, baseline: str = str(DEFAULT_BASELINE), save: bool = False, tolerance: float = 0.2):
+    """
+    Benchmark the detection pipeline. Uses synthetic claps unless ``fixture`` names a recorded WAV or raw int16 file.
+
+    :param save: write the results as the new baseline instead of comparing against it
+    :param tolerance: relative slowdown allowed before a metric is reported as a regression
+    """
+    if fixture is None:
+        sample_rate = SAMPLE_RATE
+        clap_frames = list(range(15, frames - 10, 23))
+        chunks = synthetic_chunks(frames, clap_frames, sample_rate=sample_rate)
+    else:
+        chunks, sample_rate = load_fixture(fixture)
+        clap_frames = []
+
+    results = {}
+    results |= bench_record_frame(chunks, sample_rate)
+    results |= bench_fft_backends(chunks, sample_rate)
+    results |= bench_listen(chunks, sample_rate, clap_frames)
+    if clap_frames:
+        results |= bench_calibration(chunks, sample_rate, clap_frames,
+                                     depth=calibration_depth, grid_size=calibration_grid)
+    results |= bench_fsm(fsm_repeats)
+    if not check_kernel(frames):
+        raise SystemExit('the clap kernel disagrees with the NumPy path')
+    results |= bench_startup(startup_repeats)
+    if 'detection_delay_seconds' in results:
+        results['clap_to_action_ms'] = results['detection_delay_seconds'] * 1000 + results['fsm_action_latency_ms']
+
+    baseline_path = Path(baseline)
+    if save or not baseline_path.exists():
+        baseline_path.write_text(json.dumps({'machine': platform.platform(), 'results': results}, indent=2))
+        for name, value in results.items():
+            print(f'{name:32} {value:12.4g}')
+        print(f'saved baseline to {baseline_path}')
+        return
+
+    regressions = compare(results, json.loads(baseline_path.read_text())['results'], tolerance)
+    if regressions:
+        raise SystemExit(f'regressed: {", ".join(regressions)}')
+
+
+if __name__ == '__main__':
+    fire.Fire()
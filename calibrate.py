@@ -1,13 +1,23 @@
+import dataclasses
+import hashlib
 import json
 from dataclasses import dataclass
 from queue import Queue, Empty
 from threading import Thread
-from typing import Tuple, Callable, Any, Optional
+from typing import Tuple, Callable, Any, Optional, Iterator, Sequence
 
 import numpy as np
 
+from capture_arena import CaptureArena
+from clap_classifier import ClapClassifier
 from clap_detector import ClapDetector
-from settings import Settings
+from constants import CHUNK
+from recordings import LabelledRecording
+from score_cache import ScoreCache
+from settings import Settings, max_settings
+from settings_store import SettingsStore, Profile
+
+NO_WINDOWS_MESSAGE = 'No labelled windows: are the recordings shorter than window_seconds?'
 
 
 def input_choice(choices: dict[str, Tuple[str, Callable[[], Any]]]):
@@ -20,21 +30,48 @@ def input_choice(choices: dict[str, Tuple[str, Callable[[], Any]]]):
             print(f'Bad input \'{inp}\': not one of the choices')
 
 
+@dataclass
+class ThresholdCurve:
+    thresholds: np.ndarray
+    accuracy: np.ndarray
+    true_positive_rate: np.ndarray
+    false_positive_rate: np.ndarray
+
+    @staticmethod
+    def from_peaks(thresholds: np.ndarray, peaks: np.ndarray, labels: np.ndarray) -> 'ThresholdCurve':
+        # (thresholds, windows)
+        clapped = thresholds[:, np.newaxis] < peaks
+        return ThresholdCurve(
+            thresholds,
+            (clapped == labels).mean(axis=-1),
+            clapped[:, labels].mean(axis=-1) if labels.any() else np.full(thresholds.size, np.nan),
+            clapped[:, ~labels].mean(axis=-1) if not labels.all() else np.full(thresholds.size, np.nan),
+        )
+
+    def best_threshold(self) -> float:
+        return float(self.thresholds[self.accuracy.argmax()])
+
+
 class Calibrator:
-    def __init__(self, restore_state_bytes: Optional[bytes] = None):
+    def __init__(self, restore_state_bytes: Optional[bytes] = None, *, chunk: int = CHUNK,
+                 score_cache: Optional[ScoreCache] = None):
+        """
+        :param score_cache: reuse results from earlier runs on the same windows, and keep this run's
+        """
         def raise_error():
             raise RuntimeError()
 
-        self.capturing_clap_detector = ClapDetector(raise_error)
-        self.labelled_chunks: list[Tuple[list[np.ndarray], bool]] = []
+        self.capturing_clap_detector = ClapDetector(raise_error, chunk=chunk)
+        self.labelled_chunks = CaptureArena()
+        self.recordings: list[LabelledRecording] = []
+        self.score_cache = score_cache
 
         if restore_state_bytes is not None:
             restore_state = json.loads(restore_state_bytes.decode('utf-8'))
-            self.labelled_chunks = [
-                ([np.array(chunk, dtype=np.int16) for chunk in chunks], label)
-                for chunks, label in restore_state['labelled_chunks']
-            ]
+            for chunks, label in restore_state['labelled_chunks']:
+                self.labelled_chunks.add_window(np.array(chunks, dtype=np.int16), label)
             self.capturing_clap_detector.sample_rate = restore_state['sample_rate']
+            self.capturing_clap_detector.chunk = restore_state.get('chunk', CHUNK)
 
     def capture(self) -> None:
         self.capturing_clap_detector.connect()
@@ -48,16 +85,15 @@ class Calibrator:
         input_queue = Queue()
 
         def capturing_worker():
-            working_chunks = []
             for chunk in stream:
-                working_chunks.append(chunk)
+                self.labelled_chunks.append(chunk)
                 try:
                     command = input_queue.get(block=False)
                     if command == 'exit':
+                        self.labelled_chunks.drop_unlabelled()
                         break
                     else:
-                        self.labelled_chunks.append((working_chunks, command))
-                        working_chunks = []
+                        self.labelled_chunks.label(command)
                 except Empty:
                     pass
 
@@ -77,8 +113,66 @@ class Calibrator:
 
         capturing_thread.join()
 
-    def score_settings(self, settings: Settings, verbose: bool = False) -> float:
-        if len(self.labelled_chunks) == 0:
+    def add_recording(self, audio_path: str, claps_path: Optional[str] = None, **kwargs) -> None:
+        """
+        Add a long recording, labelled by a sidecar of clap times, to score against. See ``LabelledRecording``.
+        """
+        recording = LabelledRecording(audio_path, claps_path, chunk=self.capturing_clap_detector.chunk, **kwargs)
+        sample_rate = self.capturing_clap_detector.sample_rate
+        if sample_rate is not None and sample_rate != recording.sample_rate:
+            raise ValueError(f'{audio_path} is at {recording.sample_rate}Hz, but other chunks are at {sample_rate}Hz')
+
+        # one window is enough to know it is not empty
+        if next(iter(recording), None) is None:
+            raise ValueError(f'No labelled windows in {audio_path}: is it shorter than window_seconds, or is every '
+                             f'clap too close to the end of its window?')
+
+        self.capturing_clap_detector.sample_rate = recording.sample_rate
+        self.recordings.append(recording)
+
+    def labelled_windows(self) -> Iterator[Tuple[Sequence[np.ndarray], bool]]:
+        # views of the arena, which only hands out windows already labelled
+        yield from self.labelled_chunks
+        for recording in self.recordings:
+            yield from recording
+
+    def dataset_hash(self) -> str:
+        """
+        A hash of every labelled window, the labels and the audio format, so cached results are only reused for the
+        same data. Recordings are read through once.
+        """
+        dataset_hash = hashlib.blake2b(digest_size=16)
+        detector = self.capturing_clap_detector
+        dataset_hash.update(repr((detector.sample_rate, detector.chunk, detector.channels)).encode())
+        for chunks, contains_clap in self.labelled_windows():
+            dataset_hash.update(len(chunks).to_bytes(4, 'little') + bytes([contains_clap]))
+            for chunk in chunks:
+                dataset_hash.update(np.ascontiguousarray(chunk, dtype=np.int16))
+        return dataset_hash.hexdigest()
+
+    def cached_score(self, settings: Settings, dataset: Optional[str]) -> float:
+        if dataset is None:
+            return self.score_settings(settings)
+        score = self.score_cache.score(dataset, settings)
+        if score is None:
+            score = self.score_settings(settings)
+            self.score_cache.put_score(dataset, settings, score)
+        return score
+
+    def cached_window_peaks(self, settings: Settings, dataset: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+        # the peaks do not depend on the threshold
+        settings = dataclasses.replace(settings, threshold=0)
+        if dataset is None:
+            return self.window_peaks(settings)
+        peaks = self.score_cache.window_peaks(dataset, settings)
+        if peaks is None:
+            peaks = self.window_peaks(settings)
+            self.score_cache.put_window_peaks(dataset, settings, *peaks)
+        return peaks
+
+    def score_settings(self, settings: Settings, verbose: bool = False,
+                       classifier: Optional[ClapClassifier] = None) -> float:
+        if len(self.labelled_chunks) == 0 and not self.recordings:
             raise ValueError('Cannot call score_settings before labelling some chunks')
 
         @dataclass
@@ -88,21 +182,21 @@ class Calibrator:
             def reset(self):
                 self.clapped = False
 
-            def report_clap(self):
+            def report_clap(self, clap_frame_number: int):
                 self.clapped = True
 
         clap_report = ClapReport()
 
-        clap_detector = ClapDetector(clap_report.report_clap, settings=settings)
+        clap_detector = ClapDetector(clap_report.report_clap, settings=settings, classifier=classifier)
         clap_detector.copy_state(self.capturing_clap_detector)
 
         correct_count = 0
+        total_count = 0
 
-        # copy in case threading is used
-        labelled_chunks_copy = list(self.labelled_chunks)
-
-        for chunks, contains_clap in labelled_chunks_copy:
-            clap_detector.listen(iter(chunks))
+        for chunks, contains_clap in self.labelled_windows():
+            # windows are scored independently, which is what lets threshold_curve sweep the threshold exactly
+            clap_detector.reset_history()
+            clap_detector.listen_block(chunks)
             if verbose:
                 print(f'{clap_report.clapped=}; {contains_clap=}')
 
@@ -110,22 +204,99 @@ class Calibrator:
                 correct_count += 1
 
             clap_report.reset()
+            total_count += 1
+
+        if total_count == 0:
+            raise ValueError(NO_WINDOWS_MESSAGE)
+        return correct_count / total_count
+
+    def window_peaks(self, settings: Settings) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: for each labelled window, the threshold below which ``score_settings`` would see a clap in it (see
+            ``ClapDetector.first_peak``), and whether it contains a clap. Only the threshold of ``settings`` is unused.
+        """
+        clap_detector = ClapDetector(lambda clap_frame_number: None, settings=settings)
+        clap_detector.copy_state(self.capturing_clap_detector)
+
+        peaks = []
+        labels = []
+        for chunks, contains_clap in self.labelled_windows():
+            peaks.append(clap_detector.first_peak(clap_detector.chunk_amplitudes(chunks)))
+            labels.append(contains_clap)
+        if not peaks:
+            raise ValueError(NO_WINDOWS_MESSAGE)
+        return np.array(peaks), np.array(labels, dtype=bool)
+
+    def threshold_curve(self, settings: Settings, thresholds: Optional[np.ndarray] = None) -> 'ThresholdCurve':
+        """
+        ``score_settings`` for every threshold at once, from one pass over the windows.
+
+        :param thresholds: by default, every threshold at which a window changes from clap to no clap
+        """
+        peaks, labels = self.window_peaks(settings)
+        if thresholds is None:
+            thresholds = np.unique(peaks[np.isfinite(peaks)])
+        return ThresholdCurve.from_peaks(np.asarray(thresholds, dtype=float), peaks, labels)
+
+    def train_classifier(self, settings: Settings, candidate_threshold_fraction: float = 0.5) -> ClapClassifier:
+        """
+        Train a ``ClapClassifier`` on the band features of every peak found with a lowered threshold. Peaks in windows
+        without a clap are negative examples, and the only peak in a window with a clap is a positive one.
+
+        An 'adaptive' or 'auto' threshold is only known on the device, so the best fixed threshold for the labelled
+        windows is lowered instead.
+        """
+        threshold = settings.threshold
+        if isinstance(threshold, str):
+            curve = self.threshold_curve(settings)
+            if curve.thresholds.size == 0:
+                raise ValueError('No peaks in the labelled windows to train a classifier on')
+            threshold = curve.best_threshold()
+        candidate_settings = dataclasses.replace(settings, threshold=threshold * candidate_threshold_fraction)
+        window_features: list[np.ndarray] = []
+
+        clap_detector = ClapDetector(
+            lambda clap_frame_number: window_features.append(clap_detector.last_clap_features),
+            settings=candidate_settings, record_features=True
+        )
+        clap_detector.copy_state(self.capturing_clap_detector)
 
-        return correct_count / len(labelled_chunks_copy)
+        features = []
+        labels = []
+        for chunks, contains_clap in self.labelled_windows():
+            window_features.clear()
+            clap_detector.reset_history()
+            clap_detector.listen_block(chunks)
+            if not contains_clap:
+                features += window_features
+                labels += [False] * len(window_features)
+            elif len(window_features) == 1:
+                features += window_features
+                labels.append(True)
+
+        return ClapClassifier.fit(np.array(features), np.array(labels))
 
     def state_to_bytes(self) -> bytes:
         json_ready_state = {
             'labelled_chunks': [
-                ([chunk.tolist() for chunk in chunks], label)
+                (chunks.tolist(), label)
                 for chunks, label in self.labelled_chunks
             ],
-            'sample_rate': self.capturing_clap_detector.sample_rate
+            'sample_rate': self.capturing_clap_detector.sample_rate,
+            'chunk': self.capturing_clap_detector.chunk
         }
         return json.dumps(json_ready_state).encode('utf-8')
 
-    def calibrate(self, *, depth: int, grid_size: int = 4) -> Settings:
-        maximums = max_settings.to_array()
+    def calibrate(self, *, depth: int, grid_size: int = 4, sweep: bool = True) -> Settings:
+        """
+        :param sweep: score every threshold in the grid from one pass per combination of the other settings, rather
+            than with a pass each; the scores are the same
+        """
+        # the highest frequency bin depends on the chunk size
+        maximums = dataclasses.replace(
+            max_settings, clap_freq_index=self.capturing_clap_detector.chunk // 2 - 1).to_array()
         minimums = np.ones_like(maximums)
+        dataset = None if self.score_cache is None else self.dataset_hash()
 
         winner1 = None
         for i in range(depth):
@@ -135,11 +306,22 @@ class Calibrator:
             ]), axis=maximums.size)
 
             fitness = np.empty(grid.shape[:-1])
+            # window peaks, by settings other than the threshold
+            peaks_cache: dict[Settings, Tuple[np.ndarray, np.ndarray]] = {}
 
             # winner = max(np.ndindex(grid.shape[:-1]), key=score_settings_index)
             for settings_index in np.ndindex(grid.shape[:-1]):
                 settings = Settings.from_array(grid[settings_index])
-                fitness[settings_index] = self.score_settings(settings)
+                if sweep:
+                    key = dataclasses.replace(settings, threshold=0)
+                    if key not in peaks_cache:
+                        peaks_cache[key] = self.cached_window_peaks(settings, dataset)
+                    peaks, labels = peaks_cache[key]
+                    fitness[settings_index] = ((settings.threshold < peaks) == labels).mean()
+                else:
+                    fitness[settings_index] = self.cached_score(settings, dataset)
+            if self.score_cache is not None:
+                self.score_cache.flush()
 
             if fitness.min() == fitness.max():
                 return Settings.from_array(((maximums + minimums) / 2).astype(np.int32))
@@ -159,7 +341,69 @@ class Calibrator:
         return Settings.from_array(winner1)
 
 
-def calibrate():
-    calib = Calibrator()
+def print_threshold_curve(calib: Calibrator, settings: Settings, points: int = 10):
+    curve = calib.threshold_curve(settings)
+    if curve.thresholds.size == 0:
+        return
+    print(f'{"threshold":>12} {"accuracy":>9} {"TPR":>6} {"FPR":>6}')
+    for i in np.unique(np.linspace(0, curve.thresholds.size - 1, points).astype(int)):
+        print(f'{curve.thresholds[i]:12.1f} {curve.accuracy[i]:9.3f} {curve.true_positive_rate[i]:6.3f} '
+              f'{curve.false_positive_rate[i]:6.3f}')
+
+
+def print_cache_use(calib: Calibrator):
+    if calib.score_cache is not None:
+        print(f'Score cache: {calib.score_cache.hits} hits, {calib.score_cache.misses} misses')
+
+
+def save_calibration(calib: Calibrator, settings: Settings, device_name: str, classifier: bool):
+    """
+    Save ``settings`` as the profile for ``device_name``, with a classifier trained on the same windows if wanted.
+    """
+    detector = calib.capturing_clap_detector
+    trained = None
+    if classifier:
+        try:
+            trained = calib.train_classifier(settings)
+        except ValueError as e:
+            print(f'No classifier saved: {e}')
+    profile = Profile(settings.to_physical(detector.sample_rate, detector.chunk), detector.chunk,
+                      sample_rate=detector.sample_rate, classifier=trained)
+    path = SettingsStore().save(device_name, profile)
+    print(f'Saved settings{"" if trained is None else " and classifier"} to {path}')
+
+
+def calibrate(save: bool = False, sweep: bool = True, cache: bool = True, classifier: bool = False):
+    """
+    :param cache: reuse, and keep, scores in the default ``ScoreCache``
+    :param classifier: train a ``ClapClassifier`` too, and save it with the settings
+    """
+    calib = Calibrator(score_cache=ScoreCache() if cache else None)
     calib.capture()
-    print(calib.calibrate(depth=4))
+    settings = calib.calibrate(depth=4, sweep=sweep)
+    print_cache_use(calib)
+    print(settings)
+    print_threshold_curve(calib, settings)
+    if save:
+        save_calibration(calib, settings, calib.capturing_clap_detector.device_info['name'], classifier)
+
+
+def calibrate_recordings(*audio_paths: str, depth: int = 4, window_seconds: float = 2, save: bool = False,
+                         device_name: str = 'default', sweep: bool = True, cache: bool = True,
+                         classifier: bool = False):
+    """
+    Calibrate from recordings, each labelled by a ``.claps`` file of clap times next to it.
+
+    :param save: save the result as the profile for ``device_name``
+    :param cache: reuse, and keep, scores in the default ``ScoreCache``
+    :param classifier: train a ``ClapClassifier`` too, and save it with the settings
+    """
+    calib = Calibrator(score_cache=ScoreCache() if cache else None)
+    for audio_path in audio_paths:
+        calib.add_recording(audio_path, window_seconds=window_seconds)
+    settings = calib.calibrate(depth=depth, sweep=sweep)
+    print_cache_use(calib)
+    print(settings)
+    print_threshold_curve(calib, settings)
+    if save:
+        save_calibration(calib, settings, device_name, classifier)
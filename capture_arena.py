@@ -0,0 +1,120 @@
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Optional, Iterator, Tuple
+
+import numpy as np
+
+# past this, the arena moves into a memory-mapped file, which the OS can page out
+DEFAULT_SPILL_BYTES = 256 << 20
+
+
+@dataclass(frozen=True)
+class Segment:
+    # in chunks, end exclusive
+    start: int
+    end: int
+    label: bool
+
+
+class CaptureArena:
+    """
+    Labelled audio in one contiguous int16 block of chunks, which doubles in size as it fills. Windows are handed out
+    as views of it, so scoring never copies the audio.
+
+    Appending happens on the capture thread. Growing the arena moves it rather than resizing it in place, so windows
+    handed out before still see their audio, and a window is only handed out once it is labelled and complete.
+    """
+
+    def __init__(self, initial_chunks: int = 64, spill_bytes: int = DEFAULT_SPILL_BYTES,
+                 spill_directory: Optional[str] = None):
+        """
+        :param spill_bytes: grow into a memory-mapped temporary file instead of memory past this size
+        :param spill_directory: for the temporary file; the system default if None
+        """
+        self.initial_chunks = initial_chunks
+        self.spill_bytes = spill_bytes
+        self.spill_directory = spill_directory
+        self.spilled = False
+
+        # (capacity, samples per chunk), allocated on the first chunk
+        self.data: Optional[np.ndarray] = None
+        self.chunk_count = 0
+        self.segments: list[Segment] = []
+        # where the chunks not labelled yet start
+        self.segment_start = 0
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    @property
+    def nbytes(self) -> int:
+        return 0 if self.data is None else self.data.nbytes
+
+    def reserve(self, chunk_count: int, chunk_samples: int):
+        if self.data is None:
+            self.data = np.empty((max(chunk_count, self.initial_chunks), chunk_samples), dtype=np.int16)
+            return
+        if self.data.shape[1] != chunk_samples:
+            raise ValueError(f'Chunks of {chunk_samples} samples cannot go in an arena of {self.data.shape[1]}')
+        capacity = self.data.shape[0]
+        if chunk_count <= capacity:
+            return
+
+        while capacity < chunk_count:
+            capacity *= 2
+        shape = (capacity, chunk_samples)
+        if capacity * chunk_samples * 2 > self.spill_bytes:
+            grown = self.spill(shape)
+        else:
+            grown = np.empty(shape, dtype=np.int16)
+        grown[:self.chunk_count] = self.data[:self.chunk_count]
+        self.data = grown
+
+    def spill(self, shape: tuple[int, int]) -> np.ndarray:
+        # a new file each time, so older windows keep their own mapping
+        file_descriptor, path = tempfile.mkstemp(prefix='clappy-capture-', suffix='.int16', dir=self.spill_directory)
+        os.close(file_descriptor)
+        grown = np.memmap(path, dtype=np.int16, mode='w+', shape=shape)
+        # the mapping stays valid without a name, and nothing is left behind if the process dies
+        os.unlink(path)
+        if not self.spilled:
+            print(f'Capture arena passed {self.spill_bytes / (1 << 20):g}MiB, spilling to disk')
+        self.spilled = True
+        return grown
+
+    def append(self, chunk: np.ndarray):
+        self.reserve(self.chunk_count + 1, chunk.shape[-1])
+        self.data[self.chunk_count] = chunk
+        self.chunk_count += 1
+
+    def label(self, label: bool):
+        """
+        Label every chunk appended since the last label.
+        """
+        self.segments.append(Segment(self.segment_start, self.chunk_count, label))
+        self.segment_start = self.chunk_count
+
+    def drop_unlabelled(self):
+        self.chunk_count = self.segment_start
+
+    def add_window(self, chunks: np.ndarray, label: bool):
+        """
+        :param chunks: (chunks, samples per chunk)
+        """
+        chunks = np.asarray(chunks, dtype=np.int16)
+        self.drop_unlabelled()
+        self.reserve(self.chunk_count + len(chunks), chunks.shape[-1])
+        self.data[self.chunk_count:self.chunk_count + len(chunks)] = chunks
+        self.chunk_count += len(chunks)
+        self.label(label)
+
+    def window(self, segment: Segment) -> np.ndarray:
+        return self.data[segment.start:segment.end]
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, bool]]:
+        # the segments so far, even if more are labelled meanwhile; read before the data, which then holds them all
+        segments = list(self.segments)
+        data = self.data
+        for segment in segments:
+            yield data[segment.start:segment.end], segment.label
@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+DEFAULT_BAND_COUNT = 12
+
+
+def band_matrix(bin_count: int, band_count: int = DEFAULT_BAND_COUNT) -> np.ndarray:
+    """
+    :return: a (bins, bands) matrix averaging the spectrum over log-spaced bands, skipping the DC bin
+    """
+    edges = np.unique(np.geomspace(1, bin_count, band_count + 1).astype(int))
+    matrix = np.zeros((bin_count, edges.size - 1))
+    for band, (low, high) in enumerate(zip(edges[:-1], edges[1:])):
+        matrix[low:high, band] = 1 / (high - low)
+    return matrix
+
+
+def band_features(spectrum_magnitudes: np.ndarray, bands: np.ndarray) -> np.ndarray:
+    """
+    :param spectrum_magnitudes: (..., bins)
+    :return: (..., bands) log band energies
+    """
+    return np.log1p(spectrum_magnitudes @ bands)
+
+
+@dataclass
+class ClapClassifier:
+    """
+    Logistic regression on band features, used to veto loud sounds that peak near the clap frequency but are not
+    shaped like a clap.
+    """
+    weights: np.ndarray
+    bias: float
+    mean: np.ndarray
+    scale: np.ndarray
+    min_probability: float = 0.5
+
+    def probability(self, features: np.ndarray) -> float:
+        z = ((features - self.mean) / self.scale) @ self.weights + self.bias
+        return float(1 / (1 + np.exp(-z)))
+
+    def is_clap(self, features: np.ndarray) -> bool:
+        return self.probability(features) >= self.min_probability
+
+    @staticmethod
+    def fit(features: np.ndarray, labels: np.ndarray, *, l2: float = 1e-2, iterations: int = 500,
+            learning_rate: float = 0.5) -> 'ClapClassifier':
+        features = np.asarray(features, dtype=float)
+        labels = np.asarray(labels, dtype=float)
+        if labels.min() == labels.max():
+            raise ValueError('Need both clap and non-clap examples to train a classifier')
+
+        mean = features.mean(axis=0)
+        scale = features.std(axis=0) + 1e-9
+        x = (features - mean) / scale
+
+        weights = np.zeros(x.shape[1])
+        bias = 0.0
+        for _ in range(iterations):
+            p = 1 / (1 + np.exp(-(x @ weights + bias)))
+            error = p - labels
+            weights -= learning_rate * (x.T @ error / labels.size + l2 * weights)
+            bias -= learning_rate * error.mean()
+
+        return ClapClassifier(weights, bias, mean, scale)
+
+    def to_dict(self) -> dict:
+        return {
+            'weights': self.weights.tolist(),
+            'bias': self.bias,
+            'mean': self.mean.tolist(),
+            'scale': self.scale.tolist(),
+            'min_probability': self.min_probability,
+        }
+
+    @staticmethod
+    def from_dict(d: dict) -> 'ClapClassifier':
+        return ClapClassifier(
+            np.array(d['weights']), d['bias'], np.array(d['mean']), np.array(d['scale']), d['min_probability']
+        )
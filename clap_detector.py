@@ -1,12 +1,24 @@
 import dataclasses
-from typing import Callable, Any, Optional, Union, Generator, Iterable
+import threading
+import time
+from typing import Callable, Any, Optional, Union, Generator, Iterable, Sequence, TYPE_CHECKING
 
 import numpy as np
-import pyaudio
-from scipy.ndimage import gaussian_laplace, gaussian_filter1d
+from scipy.ndimage import gaussian_filter1d
 
 from constants import *
-from settings import Settings, default_settings
+from adaptive_threshold import AdaptiveThreshold
+from audio_recorder import RingRecorder
+from clap_classifier import ClapClassifier, band_matrix, band_features
+from clap_kernel import KERNEL_AVAILABLE, detect_claps, laplacian_weights
+from fft_backend import FFTBackend, gaussian_weights
+from metrics import Metrics
+from settings import Settings, PhysicalSettings, default_settings
+from settings_store import SettingsStore, Profile
+
+if TYPE_CHECKING:
+    # imported in connect, so that offline use (calibrating from recordings, benchmarks) needs no PortAudio
+    import pyaudio
 
 
 class AudioStream:
@@ -27,29 +39,210 @@ class AudioStream:
 
 
 class ClapDetector:
-    def __init__(self, on_clap: Callable[[int], Any], settings: Settings = default_settings) -> None:
-        self.audio: Optional[pyaudio.PyAudio] = None
+    def __init__(self, on_clap: Callable[[int], Any],
+                 settings: Union[Settings, PhysicalSettings] = default_settings,
+                 on_frame: Optional[Callable[[int], Any]] = None, *,
+                 chunk: int = CHUNK, sample_rate: Optional[int] = None,
+                 channels: int = CHANNELS, min_coincident_channels: int = 1, coincidence_frames: int = 1,
+                 metrics: Optional[Metrics] = None, recorder: Optional[RingRecorder] = None,
+                 classifier: Optional[ClapClassifier] = None, record_features: bool = False,
+                 profiles: Optional[SettingsStore] = None, threshold_override: Union[float, str, None] = None,
+                 use_profile_classifier: bool = False, fft: Optional[FFTBackend] = None) -> None:
+        """
+        :param settings: ``PhysicalSettings`` are converted to bins and frames once the sample rate is known
+        :param chunk: samples per channel in each FFT frame
+        :param sample_rate: capture at this rate, rather than the device's default
+        :param channels: number of interleaved channels in each chunk; each is detected on separately
+        :param min_coincident_channels: how many channels must peak above the threshold, within
+            ``coincidence_frames`` of the strongest peak, for a clap to count
+        :param metrics: if given, record hot-path counters and timings into it
+        :param recorder: if given, keeps recent audio from ``stream`` and dumps it around each clap
+        :param classifier: if given, vetoes peaks whose band features it does not score as a clap
+        :param record_features: keep band features even without a classifier, in ``last_clap_features``
+        :param profiles: if given, ``connect`` loads the saved profile for the device, replacing ``settings``, and
+            ``stream`` hot-swaps in any changes saved to it
+        :param threshold_override: a threshold, per square root of a sample as in ``PhysicalSettings``, or 'auto', to
+            use instead of the one in the profile; a fixed one is then not saved back to the profile
+        :param use_profile_classifier: use the classifier saved with the profile, if it was trained at this chunk size
+            and sample rate
+        :param fft: computes each chunk's magnitude spectrum; numpy in double precision by default
+        """
+        self.audio: Optional['pyaudio.PyAudio'] = None
         self.amplitudes_history: Optional[np.ndarray] = None
-        self.sample_rate: Optional[int] = None
+        self.sample_rate = sample_rate
+        self.chunk = chunk
         self.device_info: Optional[dict] = None
+        self.owns_audio = True
 
-        self.settings = settings
+        self.frame_count = 0
+        self.last_clap = 0
+
+        # None until physical settings can be converted, once the sample rate is known
+        self.settings: Optional[Settings] = None
+        self.physical_settings: Optional[PhysicalSettings] = None
         self.auto_threshold = False
-        if self.settings.threshold == 'auto':
-            self.settings = dataclasses.replace(self.settings, threshold=0)
-            self.auto_threshold = True
+        # follows the noise floor when the threshold is 'adaptive'
+        self.adaptive_threshold: Optional[AdaptiveThreshold] = None
+        # the amplitudes in the history came from different frequency settings
+        self.stale_history = False
+        self.apply_settings(settings)
+        # set from other threads by update_settings, applied at the start of the next frame
+        self.pending_settings: Union[Settings, PhysicalSettings, None] = None
+
+        self.profiles = profiles
+        self.threshold_override = threshold_override
+        self.use_profile_classifier = use_profile_classifier
+        # saved with the profile, and saved back with it whether used or not
+        self.profile_classifier: Optional[ClapClassifier] = None
+        self.profile_loaded = False
+        # set to stop watching the profile for changes
+        self.profile_watch: Optional[threading.Event] = None
+        # set by stop, from any thread, to end the stream after the current chunk
+        self.stopped = threading.Event()
 
         self.on_clap = on_clap
+        self.on_frame = on_frame
+
+        self.channels = channels
+        self.min_coincident_channels = min_coincident_channels
+        self.coincidence_frames = coincidence_frames
+
+        self.metrics = metrics
+        self.recorder = recorder
+
+        self.classifier = classifier
+        self.record_features = record_features or classifier is not None
+        self.bands: Optional[np.ndarray] = None
+        # (channels, frames, bands), aligned with amplitudes_history
+        self.features_history: Optional[np.ndarray] = None
+        self.last_clap_features: Optional[np.ndarray] = None
+
+        self.fft = FFTBackend() if fft is None else fft
+        # reads the smoothed amplitude at the clap frequency straight from the spectrum; see frequency_weights
+        self.freq_weights: Optional[np.ndarray] = None
+        self.freq_weights_key: Optional[tuple] = None
+        self.laplacian_weights: Optional[np.ndarray] = None
+        self.laplacian_weights_sigma: Optional[float] = None
+
+    def apply_settings(self, settings: Union[Settings, PhysicalSettings]):
+        """
+        Switch to ``settings`` now. The threshold may be a number, 'auto' or 'adaptive'; an adaptive threshold that is
+        already running keeps its noise estimate.
+        """
+        if isinstance(settings, PhysicalSettings):
+            # kept, to be converted again if the sample rate or chunk size changes
+            self.physical_settings = settings
+            if self.sample_rate is None:
+                return
+            settings = settings.to_settings(self.sample_rate, self.chunk)
+        else:
+            self.physical_settings = None
+
+        if settings.threshold == 'auto':
+            self.auto_threshold = True
+            self.adaptive_threshold = None
+            settings = dataclasses.replace(settings, threshold=0)
+        elif settings.threshold == 'adaptive':
+            self.auto_threshold = False
+            if self.adaptive_threshold is None:
+                self.adaptive_threshold = AdaptiveThreshold()
+            settings = dataclasses.replace(settings, threshold=0)
+        else:
+            self.auto_threshold = False
+            self.adaptive_threshold = None
+
+        if self.settings is not None and (settings.clap_freq_index, settings.freq_gaussian_sigma) != (
+                self.settings.clap_freq_index, self.settings.freq_gaussian_sigma):
+            self.stale_history = True
+        self.settings = settings
+
+    def update_settings(self, settings: Union[Settings, PhysicalSettings]):
+        """
+        Hot-swap the settings of a running detector, from any thread. Buffers are kept; if the clap frequency changes,
+        the history is flattened to the first new amplitude so the change itself is not seen as a clap.
+        """
+        self.pending_settings = settings
+
+    def apply_pending_settings(self):
+        if self.pending_settings is not None:
+            settings, self.pending_settings = self.pending_settings, None
+            self.apply_settings(settings)
+
+    def profile(self) -> Profile:
+        """
+        The current settings, including a learned threshold, to be saved with ``SettingsStore.save``.
+        """
+        physical_settings = self.settings.to_physical(self.sample_rate, self.chunk)
+        if self.adaptive_threshold is not None and self.adaptive_threshold.ready:
+            return Profile(dataclasses.replace(physical_settings, threshold='adaptive'), self.chunk,
+                           self.adaptive_threshold.median, self.adaptive_threshold.mad, self.sample_rate,
+                           self.profile_classifier)
+        return Profile(physical_settings, self.chunk, sample_rate=self.sample_rate, classifier=self.profile_classifier)
+
+    def profile_settings(self, profile: Profile) -> PhysicalSettings:
+        if self.threshold_override is None:
+            return profile.settings
+        return dataclasses.replace(profile.settings, threshold=self.threshold_override)
+
+    def load_profile(self) -> bool:
+        profile = self.profiles.load(self.device_info['name'])
+        if profile is None:
+            return False
+        try:
+            self.apply_settings(self.profile_settings(profile))
+        except ValueError as e:
+            print(f'Ignoring saved settings: {e}')
+            return False
+        # the noise estimate and the classifier's band features are in units of this chunk size and sample rate
+        same_format = (profile.chunk, profile.sample_rate) == (self.chunk, self.sample_rate)
+        adaptive_threshold = profile.adaptive_threshold()
+        if adaptive_threshold is not None and self.threshold_override is None and same_format:
+            self.adaptive_threshold = adaptive_threshold
+        self.profile_classifier = profile.classifier if same_format else None
+        if self.use_profile_classifier:
+            if self.profile_classifier is None:
+                print('No classifier saved for this chunk size and sample rate')
+            else:
+                self.classifier = self.profile_classifier
+                self.record_features = True
+        self.stale_history = False
+        return True
+
+    def save_profile(self):
+        if self.threshold_override not in (None, 'auto'):
+            print('Not saving settings: the threshold was overridden')
+            return
+        path = self.profiles.save(self.device_info['name'], self.profile())
+        print(f'Saved settings to {path}')
 
     def copy_state(self, other: 'ClapDetector'):
         self.sample_rate = other.sample_rate
-        self.amplitudes_history = np.zeros(self.seconds_to_buffer_size(AMPLITUDES_HISTORY_SECONDS))
+        self.chunk = other.chunk
+        self.allocate_history()
+
+    def allocate_history(self):
+        if self.physical_settings is not None:
+            self.apply_settings(self.physical_settings)
+        # one row of amplitudes per channel
+        self.amplitudes_history = np.zeros((self.channels, self.seconds_to_buffer_size(AMPLITUDES_HISTORY_SECONDS)))
+        self.features_history = None
 
     def seconds_to_buffer_size(self, seconds: float) -> int:
-        return int(seconds * self.sample_rate / CHUNK)
+        return int(seconds * self.frames_per_second)
+
+    @property
+    def frames_per_second(self) -> float:
+        return self.sample_rate / self.chunk
+
+    def connect(self, verbose: bool = False, *, device_name: str = 'default',
+                audio: Optional['pyaudio.PyAudio'] = None):
+        """
+        :param audio: share an existing PortAudio instance; it is then left running when the stream stops
+        """
+        import pyaudio
 
-    def connect(self, verbose: bool = False):
-        self.audio = pyaudio.PyAudio()
+        self.owns_audio = audio is None
+        self.audio = pyaudio.PyAudio() if audio is None else audio
 
         info = self.audio.get_host_api_info_by_index(0)
         device_infos = {
@@ -63,83 +256,309 @@ class ClapDetector:
                 print(f"Input Device id {i} - {device_info['name']}")
 
         self.device_info = next(
-            device_info for device_info in device_infos.values() if device_info['name'] == 'default')
-        self.sample_rate = int(self.device_info['defaultSampleRate'])
+            device_info for device_info in device_infos.values() if device_info['name'] == device_name)
+        if self.sample_rate is None:
+            self.sample_rate = int(self.device_info['defaultSampleRate'])
         if verbose:
             print(f'{self.sample_rate=}')
 
-        self.amplitudes_history = np.zeros(self.seconds_to_buffer_size(AMPLITUDES_HISTORY_SECONDS))
+        if self.device_info['maxInputChannels'] < self.channels:
+            raise ValueError(f"{device_name} has only {self.device_info['maxInputChannels']} input channels")
+
+        self.allocate_history()
+
+        if self.profiles is not None:
+            self.profile_loaded = self.load_profile()
+            if verbose and self.profile_loaded:
+                print(f'Loaded settings {self.settings}')
+            self.profile_watch = self.profiles.watch(self)
 
     def stream(self) -> AudioStream:
         def stream_generator():
-            stream = self.audio.open(format=FORMAT, channels=CHANNELS,
+            stream = self.audio.open(format=FORMAT, channels=self.channels,
                                      rate=self.sample_rate, input=True,
                                      input_device_index=self.device_info['index'],
-                                     frames_per_buffer=CHUNK)
-
-            while True:
-                chunk_bytes = stream.read(CHUNK, exception_on_overflow=False)
+                                     frames_per_buffer=self.chunk)
+            if self.recorder is not None:
+                self.recorder.start(self.sample_rate, self.channels)
+
+            while not self.stopped.is_set():
+                # an overflow raised by read would discard the chunk, so it is never raised; instead, a backlog of
+                # more than a chunk is counted, as audio is only lost after that
+                if self.metrics is not None and stream.get_read_available() > self.chunk:
+                    self.metrics.counter(
+                        'clappy_capture_backlog_total', 'reads that found more than a chunk of audio waiting'
+                    ).inc()
+                chunk_bytes = stream.read(self.chunk, exception_on_overflow=False)
                 chunk_array = np.frombuffer(chunk_bytes, dtype=np.int16)
+                if self.recorder is not None:
+                    self.recorder.write(chunk_array)
                 if (yield chunk_array):
                     break
 
             stream.stop_stream()
             stream.close()
-            self.audio.terminate()
+            if self.profile_watch is not None:
+                self.profile_watch.set()
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.owns_audio:
+                self.audio.terminate()
 
         return AudioStream(stream_generator())
 
+    def stop(self):
+        """
+        End ``stream`` from another thread; ``AudioStream.stop`` only works from the thread iterating it. A stop that
+        comes before the stream has started still ends it, as soon as it does.
+        """
+        self.stopped.set()
+
     def listen(self, stream: Union[Generator[np.ndarray, bool, Any], Iterable[np.ndarray]] = None, *, verbose=False):
-        stream = self.stream() if stream is None else stream
-        frame_count = 0
-        last_clap = 0
+        if stream is None:
+            # before the stream starts, so that a stop while the device opens is not lost
+            self.stopped.clear()
+            stream = self.stream()
+        self.frame_count = 0
+        self.last_clap = 0
+
+        metrics = self.metrics
+        if metrics is not None:
+            read_wait = metrics.histogram('clappy_stream_read_seconds', 'time blocked reading a chunk')
+            dsp_time = metrics.histogram('clappy_frame_dsp_seconds', 'DSP time per chunk')
 
         try:
             while True:
-                self.record_frame(stream)
-
-                # find peaks
-                gaussian_laplace_results = gaussian_laplace(
-                    self.amplitudes_history,
-                    sigma=self.settings.gaussian_laplace_sigma,
-                    mode='nearest'
-                )
-                max_index = gaussian_laplace_results[last_clap:].argmax() + last_clap
-                max_value = gaussian_laplace_results[max_index]
-                if verbose:
-                    print(f'{max_value=}')
-
-                if max_value > self.settings.threshold and max_index < gaussian_laplace_results.size - 3:
-                    self.on_clap(frame_count - gaussian_laplace_results.size + max_index)
-                    last_clap = gaussian_laplace_results.size
-
-                    self.amplitudes_history[:] = self.amplitudes_history[-1]
-
-                    if self.auto_threshold:
-                        new_threshold = max(int(max_value * AUTO_THRESHOLD_FRACTION), self.settings.threshold)
-                        self.settings = dataclasses.replace(self.settings, threshold=new_threshold)
-
-                frame_count += 1
-                last_clap = max(last_clap - 1, 0)
+                if metrics is None:
+                    self.record_frame(stream)
+                    self.process_frame(verbose=verbose)
+                else:
+                    start = time.perf_counter()
+                    chunk = next(stream)
+                    read_done = time.perf_counter()
+                    self.record_chunk(chunk)
+                    self.process_frame(verbose=verbose)
+                    read_wait.observe(read_done - start)
+                    dsp_time.observe(time.perf_counter() - read_done)
 
         except KeyboardInterrupt:
             stream.stop()
         except StopIteration:
             pass
 
+    def listen_block(self, chunks: Sequence[np.ndarray], *, verbose=False):
+        """
+        As ``listen``, over prerecorded chunks, as when calibrating. When ``can_use_kernel``, that is one batched FFT and
+        one call into the compiled kernel, and ``on_clap`` is only called once the whole block has been processed.
+        """
+        self.frame_count = 0
+        self.last_clap = 0
+
+        if self.can_use_kernel() and not verbose:
+            if len(chunks):
+                self.process_amplitudes(self.chunk_amplitudes(list(chunks)))
+            return
+
+        for chunk in chunks:
+            self.record_chunk(chunk)
+            self.process_frame(verbose=verbose)
+
+    def can_use_kernel(self) -> bool:
+        """
+        Whether ``process_amplitudes`` can stand in for ``process_frame``: the kernel is compiled, and none of the
+        per-frame extras are in use.
+        """
+        return (KERNEL_AVAILABLE and self.channels == 1 and self.min_coincident_channels == 1
+                and self.adaptive_threshold is None and self.classifier is None and not self.record_features
+                and self.on_frame is None and self.recorder is None and self.metrics is None)
+
+    def chunk_amplitudes(self, chunks: list[np.ndarray]) -> np.ndarray:
+        """
+        :return: the amplitude at the clap frequency of each of the mono ``chunks``
+        """
+        self.apply_pending_settings()
+        spectrum_magnitudes = self.fft.magnitudes(np.stack(chunks))
+        return spectrum_magnitudes @ self.frequency_weights(spectrum_magnitudes.shape[-1], spectrum_magnitudes.dtype)
+
+    def reset_history(self):
+        """
+        Start afresh from the next frame: the history is flattened to its amplitude, and nothing before it can clap.
+        """
+        self.stale_history = True
+        self.features_history = None
+
+    def first_peak(self, amplitudes: np.ndarray) -> float:
+        """
+        For a fixed threshold, with the history reset before the first of the mono ``amplitudes``, a clap is reported
+        iff ``threshold < first_peak(amplitudes)``: until the first clap, nothing depends on the threshold, so this is
+        the highest peak that would pass the margin check on any frame. -inf if none would.
+        """
+        history_size = self.amplitudes_history.shape[-1]
+        padded = np.concatenate([np.full(history_size - 1, amplitudes[0]), amplitudes])
+        # the history after each frame, one per row
+        histories = np.lib.stride_tricks.sliding_window_view(padded, history_size)
+        gaussian_laplace_results = gaussian_filter1d(
+            histories,
+            sigma=self.settings.gaussian_laplace_sigma,
+            axis=-1,
+            order=2,
+            mode='nearest'
+        )
+        max_indices = gaussian_laplace_results.argmax(axis=-1)
+        max_values = gaussian_laplace_results.max(axis=-1)
+        reportable = max_values[max_indices < history_size - PEAK_MARGIN_FRAMES]
+        return float(reportable.max()) if reportable.size else -np.inf
+
+    def process_amplitudes(self, amplitudes: np.ndarray, kernel: Callable = detect_claps):
+        """
+        Record and process a block of mono amplitudes with the clap kernel, giving the same claps as ``record_spectrum``
+        then ``process_frame`` for each. ``on_clap`` is called once the whole block has been processed.
+
+        :param kernel: ``clap_kernel.detect_claps_python`` runs the kernel uncompiled, to check it
+        """
+        self.apply_pending_settings()
+        if self.laplacian_weights_sigma != self.settings.gaussian_laplace_sigma:
+            self.laplacian_weights = laplacian_weights(self.settings.gaussian_laplace_sigma)
+            self.laplacian_weights_sigma = self.settings.gaussian_laplace_sigma
+
+        claps, self.frame_count, self.last_clap, threshold = kernel(
+            self.amplitudes_history[0], np.asarray(amplitudes, dtype=np.float64), self.laplacian_weights,
+            self.frame_count, self.last_clap, float(self.settings.threshold), self.auto_threshold,
+            AUTO_THRESHOLD_FRACTION, PEAK_MARGIN_FRAMES, self.stale_history
+        )
+        self.stale_history = False
+        if self.auto_threshold:
+            self.settings = dataclasses.replace(self.settings, threshold=int(threshold))
+
+        for clap_frame_number in claps:
+            self.on_clap(int(clap_frame_number))
+
+    def process_frame(self, *, verbose=False):
+        """
+        Look for a clap in the amplitude history, after a new frame has been recorded.
+        """
+        # find peaks; a 1D gaussian_laplace along each channel's history
+        gaussian_laplace_results = gaussian_filter1d(
+            self.amplitudes_history,
+            sigma=self.settings.gaussian_laplace_sigma,
+            axis=-1,
+            order=2,
+            mode='nearest'
+        )
+        history_size = gaussian_laplace_results.shape[-1]
+        max_indices = gaussian_laplace_results[:, self.last_clap:].argmax(axis=-1) + self.last_clap
+        max_values = np.take_along_axis(gaussian_laplace_results, max_indices[:, np.newaxis], axis=-1)[:, 0]
+        if self.adaptive_threshold is None:
+            threshold = self.settings.threshold
+        else:
+            threshold = self.adaptive_threshold.threshold if self.adaptive_threshold.ready else np.inf
+            # sample the newest reportable position, once the initial zeros have left the history
+            if self.frame_count >= history_size:
+                self.adaptive_threshold.update(gaussian_laplace_results[:, -PEAK_MARGIN_FRAMES - 1].max())
+        peaks = (max_values > threshold) & (max_indices < history_size - PEAK_MARGIN_FRAMES)
+
+        strongest_channel = np.where(peaks, max_values, -np.inf).argmax() if peaks.any() else max_values.argmax()
+        max_index = max_indices[strongest_channel]
+        max_value = max_values[strongest_channel]
+        if verbose:
+            print(f'{max_value=}')
+
+        if self.metrics is not None and peaks.any():
+            self.metrics.counter('clappy_peaks_above_threshold_total', 'frames with a peak over the threshold').inc()
+
+        coincident_count = np.count_nonzero(peaks & (np.abs(max_indices - max_index) <= self.coincidence_frames))
+        is_clap = coincident_count >= self.min_coincident_channels and peaks[strongest_channel]
+        if is_clap and self.record_features:
+            # the Laplacian peaks on a flank of the clap, so take the features where the amplitude itself peaks
+            radius = max(1, round(2 * self.settings.gaussian_laplace_sigma))
+            search_start = max(max_index - radius, 0)
+            loudest_index = search_start + self.amplitudes_history[
+                strongest_channel, search_start:max_index + radius + 1].argmax()
+            self.last_clap_features = self.features_history[strongest_channel, loudest_index].copy()
+            if self.classifier is not None and not self.classifier.is_clap(self.last_clap_features):
+                # loud, but not shaped like a clap; look past this peak from now on
+                self.last_clap = max_index + 1
+                is_clap = False
+
+        if is_clap:
+            if self.metrics is not None:
+                self.metrics.counter('clappy_claps_total', 'claps emitted').inc()
+            clap_frame_number = self.frame_count - history_size + max_index
+            if self.recorder is not None:
+                self.recorder.trigger('clap', at_sample=clap_frame_number * self.chunk)
+            self.on_clap(clap_frame_number)
+            self.last_clap = history_size
+
+            # flatten to the background level; with short chunks the newest frame can still hold the clap's tail,
+            # and its drop back to the background would look like another clap
+            self.amplitudes_history[:] = np.median(self.amplitudes_history, axis=-1, keepdims=True)
+
+            if self.auto_threshold:
+                new_threshold = max(int(max_value * AUTO_THRESHOLD_FRACTION), self.settings.threshold)
+                self.settings = dataclasses.replace(self.settings, threshold=new_threshold)
+
+        if self.on_frame is not None:
+            self.on_frame(self.frame_count)
+
+        self.frame_count += 1
+        self.last_clap = max(self.last_clap - 1, 0)
+
     def record_frame(self, stream: Generator[np.ndarray, bool, Any]):
-        # get frequencies from microphone
-        chunk_fft = np.fft.rfft(next(stream))
-        # get relevant frequency datum
-        gaussian_result = gaussian_filter1d(np.abs(chunk_fft), self.settings.freq_gaussian_sigma)
-        # print(f"{gaussian_result[55]:10.0f}, {gaussian_result[250]:10.0f}")
-        amplitude = gaussian_result[self.settings.clap_freq_index]
+        self.record_chunk(next(stream))
+
+    def split_channels(self, chunk: np.ndarray) -> np.ndarray:
+        """
+        :return: the interleaved chunk as a (channels, samples) view
+        """
+        return chunk.reshape(-1, self.channels).T
+
+    def record_chunk(self, chunk: np.ndarray):
+        # get frequencies from microphone, all channels in one rfft
+        self.record_spectrum(self.fft.magnitudes(self.split_channels(chunk)))
+
+    def frequency_weights(self, bin_count: int, dtype: np.dtype) -> np.ndarray:
+        """
+        The Gaussian frequency smoothing, restricted to the clap frequency bin, as one weight per bin.
+        """
+        key = (bin_count, self.settings.freq_gaussian_sigma, self.settings.clap_freq_index, dtype)
+        if key != self.freq_weights_key:
+            self.freq_weights = gaussian_weights(
+                bin_count, self.settings.freq_gaussian_sigma, self.settings.clap_freq_index).astype(dtype)
+            self.freq_weights_key = key
+        return self.freq_weights
+
+    def record_spectrum(self, spectrum_magnitudes: np.ndarray):
+        """
+        :param spectrum_magnitudes: (channels, bins), or (bins,) for a single channel
+        """
+        self.apply_pending_settings()
+
+        # get relevant frequency datum: the gaussian-smoothed spectrum, at the clap frequency
+        amplitude = spectrum_magnitudes @ self.frequency_weights(spectrum_magnitudes.shape[-1],
+                                                                 spectrum_magnitudes.dtype)
         # record in array
-        self.amplitudes_history[:-1] = self.amplitudes_history[1:]
-        self.amplitudes_history[-1] = amplitude
+        if self.stale_history:
+            self.amplitudes_history[:] = np.reshape(amplitude, (-1, 1))
+            self.stale_history = False
+        else:
+            self.amplitudes_history[:, :-1] = self.amplitudes_history[:, 1:]
+            self.amplitudes_history[:, -1] = amplitude
+
+        if self.record_features:
+            self.record_features_frame(np.atleast_2d(spectrum_magnitudes))
+
+    def record_features_frame(self, spectrum_magnitudes: np.ndarray):
+        if self.bands is None or self.bands.shape[0] != spectrum_magnitudes.shape[-1]:
+            self.bands = band_matrix(spectrum_magnitudes.shape[-1])
+        features = band_features(spectrum_magnitudes, self.bands)
+
+        if self.features_history is None:
+            self.features_history = np.zeros((*self.amplitudes_history.shape, features.shape[-1]))
+        self.features_history[:, :-1] = self.features_history[:, 1:]
+        self.features_history[:, -1] = features
 
 
 def clappy_test(settings: Settings = default_settings, *, verbose=False):
-    clappy = ClapDetector(lambda: print("clap!"), settings=settings)
+    clappy = ClapDetector(lambda clap_frame_number: print("clap!"), settings=settings)
     clappy.connect(verbose=verbose)
     clappy.listen(verbose=verbose)
@@ -0,0 +1,85 @@
+"""
+The mono amplitude-to-clap state machine of ``ClapDetector.process_frame``, over a whole block of frames in one call.
+
+``detect_claps`` is compiled with numba when it is installed; ``KERNEL_AVAILABLE`` says whether it was. Without numba,
+``ClapDetector`` keeps to its per-frame NumPy path, as the plain Python loops here would be slower than that.
+"""
+import numpy as np
+from scipy.ndimage import gaussian_filter1d
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+KERNEL_AVAILABLE = numba is not None
+
+
+def laplacian_weights(sigma: float) -> np.ndarray:
+    """
+    The weights ``gaussian_filter1d(..., order=2)`` correlates with, read off its response to an impulse so that they
+    are bit for bit the same.
+    """
+    radius = int(4.0 * sigma + 0.5)
+    impulse = np.zeros(2 * radius + 1)
+    impulse[radius] = 1
+    return gaussian_filter1d(impulse, sigma, order=2, mode='constant')[::-1].copy()
+
+
+def detect_claps_python(history: np.ndarray, amplitudes: np.ndarray, weights: np.ndarray,
+                        frame_count: int, last_clap: int, threshold: float, auto_threshold: bool,
+                        auto_fraction: float, margin: int, stale_history: bool):
+    """
+    Record each of ``amplitudes`` into ``history`` (in place) and look for a clap after each, exactly as
+    ``ClapDetector.record_spectrum`` followed by ``process_frame`` would for one channel.
+
+    The Laplacian is summed in the same order as scipy's symmetric-kernel correlation, so the clap indices match the
+    NumPy path exactly.
+
+    :return: clap frame numbers, and the new frame_count, last_clap and threshold
+    """
+    size = history.shape[0]
+    radius = weights.shape[0] // 2
+    laplacian = np.empty(size)
+    claps = np.empty(amplitudes.shape[0], dtype=np.int64)
+    clap_count = 0
+
+    for amplitude in amplitudes:
+        if stale_history:
+            history[:] = amplitude
+            stale_history = False
+        else:
+            history[:-1] = history[1:]
+            history[-1] = amplitude
+
+        for i in range(size):
+            total = history[i] * weights[radius]
+            for j in range(1, radius + 1):
+                # 'nearest' boundary mode
+                total += (history[min(i + j, size - 1)] + history[max(i - j, 0)]) * weights[radius + j]
+            laplacian[i] = total
+
+        max_index = last_clap
+        for i in range(last_clap + 1, size):
+            if laplacian[i] > laplacian[max_index]:
+                max_index = i
+        max_value = laplacian[max_index]
+
+        if max_value > threshold and max_index < size - margin:
+            claps[clap_count] = frame_count - size + max_index
+            clap_count += 1
+            last_clap = size
+            history[:] = np.median(history)
+            if auto_threshold:
+                threshold = max(float(int(max_value * auto_fraction)), threshold)
+
+        frame_count += 1
+        last_clap = max(last_clap - 1, 0)
+
+    return claps[:clap_count], frame_count, last_clap, threshold
+
+
+if numba is not None:
+    detect_claps = numba.njit(cache=True)(detect_claps_python)
+else:
+    detect_claps = detect_claps_python
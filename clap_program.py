@@ -0,0 +1,124 @@
+import asyncio
+import functools
+from dataclasses import dataclass
+from typing import Optional, Callable, Union
+
+import fsm.regular_expressions as rex
+from fsm import grammar
+from fsm.actions import Print, Action
+from fsm.deterministic_finite_state_machine import DFSMachine
+from fsm.events import Wait
+from fsm.notifier import Notifier
+from input_devices import press
+
+
+@dataclass(frozen=True)
+class Press(Action):
+    key: str
+    device: str
+    loop: asyncio.AbstractEventLoop
+
+    async def run(self):
+        await self.loop.run_in_executor(None, lambda: press(self.device, self.key))
+
+
+@dataclass
+class ClapProgram:
+    # whether to ignore claps until notify_finished_calibration
+    calibrating: bool = True
+    # a gesture grammar, or tables compiled from one, to use instead of the gestures below; see fsm.grammar
+    gestures: Optional[str] = None
+    finished_calibration: Optional[Notifier] = None
+    loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def notify_finished_calibration(self):
+        asyncio.run_coroutine_threadsafe(self.finished_calibration.notify(), self.loop)
+
+    def gesture_actions(self, names: set[str]) -> dict[str, set[Action]]:
+        """
+        The actions a gesture grammar can name: those of the gestures below, and KEY_... to press any key.
+        """
+        press_ev: Callable[[str], Press] = functools.partial(Press, device='/dev/input/event3', loop=self.loop)
+        actions = {
+            'clap': {Print('clap')},
+            'play_pause': {Print('play/pause'), press_ev('KEY_PLAYPAUSE')},
+            'left': {Print('left'), press_ev('KEY_LEFT')},
+            'right': {Print('right'), press_ev('KEY_RIGHT')},
+            'start_listening': {Print('start listening!')},
+        }
+        actions.update({name: {Print(name), press_ev(name)} for name in names if name.startswith('KEY_')})
+        return actions
+
+    def load_gestures(self, clap_notifier: Notifier) -> DFSMachine:
+        tables = grammar.load_gestures(self.gestures)
+        return DFSMachine.from_tables(
+            tables,
+            'calibrating' if self.calibrating else 'main',
+            {grammar.CLAP: clap_notifier.event(), 'finished_calibration': self.finished_calibration.event()},
+            self.gesture_actions(grammar.action_names(tables))
+        )
+
+    async def generate_regex(self, clap_notifier: Notifier) -> Union[rex.RegularExpression, DFSMachine]:
+        self.finished_calibration = Notifier('finished_calibration')
+        self.loop = asyncio.get_event_loop()
+        if self.gestures is not None:
+            return self.load_gestures(clap_notifier)
+
+        press_ev: Callable[[str], Press] = functools.partial(Press, device='/dev/input/event3', loop=self.loop)
+
+        def wait(t):
+            return rex.Event(Wait(t))
+
+        timeout = 2
+        long_clap_delay = 0.75
+
+        def long(ev):
+            return wait(long_clap_delay) >> (
+                    ev | wait(timeout - long_clap_delay)
+            )
+
+        def short(ev):
+            return ev | wait(long_clap_delay) >> wait(timeout - long_clap_delay)
+
+        def clap(actions: set[Action] = frozenset()):
+            return clap_notifier.event_re(actions | {Print('clap')})
+
+        # .s.s.{play_pause}(.{left})*
+        play_pause_left = (
+                clap() >>
+                short(clap() >>
+                      short(
+                          clap({Print('play/pause'), press_ev('KEY_PLAYPAUSE')}) >>
+                          rex.Many(
+                              clap({Print('left'), press_ev('KEY_LEFT')})
+                          ) >>
+                          wait(timeout)
+                      )))
+        # .s.l.{left}(.{left})*
+        skip_left = (
+                clap() >>
+                short(clap() >>
+                      long(
+                          rex.Some(
+                              clap({Print('left'), press_ev('KEY_LEFT')})
+                          ) >>
+                          wait(timeout)
+                      )))
+        # .l.s.{right}(.{right})*
+        skip_right = (
+                clap() >>
+                long(clap() >>
+                     short(
+                         rex.Some(
+                             clap({Print('right'), press_ev('KEY_RIGHT')})
+                         ) >>
+                         wait(timeout)
+                     )))
+
+        gestures = rex.Many(play_pause_left | skip_left | skip_right)
+        if not self.calibrating:
+            return gestures
+
+        whilst_calibrating = rex.Many(clap()) >> self.finished_calibration.event_re({Print('start listening!')})
+
+        return whilst_calibrating >> gestures
@@ -1,76 +1,221 @@
-import time
-from threading import Lock, Thread
+from threading import Lock
+from typing import Optional, Tuple
 
 import numpy as np
 
 from clap_detector import ClapDetector
-from constants import CHUNK
+from constants import PEAK_MARGIN_FRAMES
 from settings import Settings, default_settings
+from timer_scheduler import TimerScheduler, TimerHandle
+
+
+def rounded_ratio(numerator: int, denominator: int) -> int:
+    """
+    ``round(numerator / denominator)`` for non-negative integers, rounding halves to even as ``round`` does.
+    """
+    quotient, remainder = divmod(numerator, denominator)
+    if 2 * remainder > denominator or 2 * remainder == denominator and quotient % 2 == 1:
+        return quotient + 1
+    return quotient
+
+
+def encode_command(command_index: int) -> list[int]:
+    """
+    The clap times, in units of the first interval, that ``ClapSequenceBinary.decode_sequence`` decodes to
+    ``command_index``: each interval is the one before it times the step to the next set bit.
+    """
+    times = [0, 1]
+    interval = 1
+    previous_bit = -1
+    for bit in range(command_index.bit_length()):
+        if command_index >> bit & 1:
+            interval *= bit - previous_bit
+            times.append(times[-1] + interval)
+            previous_bit = bit
+    return times
+
+
+class ToleranceDecoder:
+    """
+    Decodes a clap sequence from audio timestamps alone, against the clap times ``encode_command`` gives each command,
+    so it decodes the same gestures as ``ClapSequenceBinary.decode_sequence``. The first two claps set the unit
+    interval.
+
+    Every command still possible is scored by the Gaussian log-likelihood of its timing residuals, with the unit
+    re-fitted to all the claps it explains. A command is ruled out by a residual over ``tolerance`` units, or by one of
+    its slots passing without a clap. The sequence is decided as soon as every command left is complete.
+    """
+
+    def __init__(self, sequence_length: int, command_count: int, tolerance: float = 0.3, sigma: float = 0.1,
+                 detection_delay: int = PEAK_MARGIN_FRAMES + 1):
+        self.sequence_length = sequence_length
+        self.command_count = command_count
+        self.tolerance = tolerance
+        self.sigma = sigma
+        # claps are reported this many frames after they happen
+        self.detection_delay = detection_delay
+
+    @staticmethod
+    def slots(command_index: int) -> list[int]:
+        # the claps after the first two, in units from the first
+        return encode_command(command_index)[2:]
+
+    def score(self, sequence: list[int], command_index: int, now: int) -> Optional[Tuple[float, bool]]:
+        """
+        :return: ``(log likelihood, complete)``, or ``None`` if the command is ruled out
+        """
+        slots = self.slots(command_index)
+        observed_count = len(sequence) - 2
+        if observed_count > len(slots):
+            return None
+
+        units = [1] + slots[:observed_count]
+        offsets = [t - sequence[0] for t in sequence[1:]]
+        unit = sum(n * offset for n, offset in zip(units, offsets)) / sum(n * n for n in units)
+        if unit <= 0:
+            return None
+
+        residuals = [(offset - n * unit) / unit for n, offset in zip(units, offsets)]
+        if any(abs(residual) > self.tolerance for residual in residuals):
+            return None
+
+        complete = observed_count == len(slots)
+        if not complete:
+            next_slot_end = sequence[0] + (slots[observed_count] + self.tolerance) * unit
+            if next_slot_end < now - self.detection_delay:
+                return None
+
+        return -sum(residual * residual for residual in residuals) / (2 * self.sigma ** 2), complete
+
+    def decide(self, sequence: list[int], now: int) -> Tuple[bool, Optional[int]]:
+        """
+        :return: ``(decided, command_index)``; a decided sequence with no command index matched nothing
+        """
+        if len(sequence) < 2:
+            return False, None
+
+        scores = {
+            command_index: score
+            for command_index in range(1, self.command_count + 1)
+            for score in (self.score(sequence, command_index, now),)
+            if score is not None
+        }
+        if not scores:
+            return True, None
+        if all(complete for _, complete in scores.values()):
+            return True, max(scores, key=lambda command_index: scores[command_index][0])
+        return False, None
 
 
 class ClapSequenceBinary:
-    def __init__(self, options, settings: Settings = default_settings, max_delay=1.5, min_delay=0.05):
+    def __init__(self, options, settings: Settings = default_settings, max_delay=1.5, min_delay=0.05,
+                 scheduler: Optional[TimerScheduler] = None, tolerance: Optional[float] = None):
+        """
+        :param tolerance: if given, decode on audio timestamps with a ``ToleranceDecoder`` of this tolerance instead of
+            waiting on the wall clock
+        """
         self.options = options
         self.sequence_length = int(np.ceil(np.log2(len(options) + 1)))
-        self.sequence = []
+        # clap times, in audio frames
+        self.sequence: list[int] = []
+
+        self.decoder: Optional[ToleranceDecoder] = None
+        if tolerance is not None:
+            self.decoder = ToleranceDecoder(self.sequence_length, len(options), tolerance=tolerance)
 
-        self.clap_detector = ClapDetector(self.on_clap, settings=settings)
+        self.clap_detector = ClapDetector(
+            self.on_clap, settings=settings,
+            on_frame=self.on_frame if self.decoder is not None else None
+        )
 
         self.min_delay = min_delay
         self.max_delay = max_delay
 
-        self.sequence_wait_thread = None
+        self.scheduler = TimerScheduler() if scheduler is None else scheduler
+        self.sequence_deadline: Optional[TimerHandle] = None
+        # bumped on every reset, so a deadline that fires late can tell its sequence is gone
+        self.sequence_generation = 0
         self.lock = Lock()
 
-    def on_clap(self, clap_frame_number):
+    def reset_sequence(self):
+        if self.sequence_deadline is not None:
+            self.sequence_deadline.cancel()
+            self.sequence_deadline = None
+        self.sequence = []
+        self.sequence_generation += 1
+
+    def on_clap(self, clap_frame_number: int):
         print('clap')
-        fps = self.clap_detector.sample_rate / CHUNK
-        clap_time = clap_frame_number / fps
+        fps = self.clap_detector.frames_per_second
+        command_index = None
         with self.lock:
-            t = clap_time
+            t = clap_frame_number
             if self.sequence:
-                if t - self.sequence[0] > self.max_delay * (self.sequence_length + 3):
-                    self.sequence = []
-                elif len(self.sequence) == 1 and t - self.sequence[-1] < self.min_delay:
+                if t - self.sequence[0] > self.max_delay * (self.sequence_length + 3) * fps:
+                    self.reset_sequence()
+                elif len(self.sequence) == 1 and t - self.sequence[-1] < self.min_delay * fps:
                     return
             self.sequence.append(t)
 
-            if len(self.sequence) == 2:
-                wait_time = (self.sequence[1] - self.sequence[0]) * (self.sequence_length + 1)
-                self.sequence_wait_thread = Thread(target=lambda: self.sequence_wait(wait_time))
-                self.sequence_wait_thread.start()
+            if self.decoder is not None:
+                command_index = self.decide(t)
+            elif len(self.sequence) == 2:
+                wait_time = (self.sequence[1] - self.sequence[0]) * (self.sequence_length + 1) / fps
+                generation = self.sequence_generation
+                self.sequence_deadline = self.scheduler.schedule(
+                    wait_time, lambda: self.sequence_wait(generation))
 
-    def sequence_wait(self, wait_time):
-        time.sleep(wait_time)
+        self.run_command(command_index)
+
+    def on_frame(self, frame_number: int):
         with self.lock:
-            if len(self.sequence) >= 2:
-                self.process_sequence(self.sequence)
-                self.sequence = []
+            command_index = self.decide(frame_number)
+        self.run_command(command_index)
 
-    def process_sequence(self, sequence):
-        sequence = np.array(sequence)
-        differences = sequence[1:] - sequence[:-1]
-        command_sequence = differences[1:] / differences[:-1]
+    def decide(self, now: int) -> Optional[int]:
+        decided, command_index = self.decoder.decide(self.sequence, now)
+        if decided:
+            self.reset_sequence()
+        return command_index
 
-        command_bits = np.zeros(self.sequence_length, dtype=bool)
-        command_bit_index = -1
-        for command in command_sequence:
-            command_bit_index += round(command)
-            if not 0 <= command_bit_index < command_bits.shape[0]:
+    def run_command(self, command_index: Optional[int]):
+        if command_index is not None and 0 < command_index <= len(self.options):
+            print(f'{command_index:0{self.sequence_length}b}', command_index)
+            command_function = self.options[command_index - 1]
+            command_function()
+
+    def sequence_wait(self, generation: int):
+        with self.lock:
+            if generation != self.sequence_generation:
                 return
-            command_bits[command_bit_index] = True
+            sequence = self.sequence
+            self.sequence_deadline = None
+            self.reset_sequence()
+
+        if len(sequence) >= 2:
+            self.process_sequence(sequence)
+
+    def decode_sequence(self, sequence: list[int]) -> Optional[int]:
+        differences = [b - a for a, b in zip(sequence, sequence[1:])]
 
         command_index = 0
-        command_column_multiplier = 1
-        for i, bit in enumerate(command_bits):
-            command_index += bit * command_column_multiplier
-            command_column_multiplier *= 2
+        command_bit_index = -1
+        for previous, difference in zip(differences, differences[1:]):
+            if previous <= 0:
+                return None
+            command_bit_index += rounded_ratio(difference, previous)
+            if not 0 <= command_bit_index < self.sequence_length:
+                return None
+            command_index |= 1 << command_bit_index
 
-        if command_index > 0:
-            print(command_bits, command_index)
-            command_function = self.options[command_index - 1]
-            command_function()
+        return command_index
+
+    def process_sequence(self, sequence: list[int]):
+        self.run_command(self.decode_sequence(sequence))
 
     def listen(self, *, verbose=False):
         self.clap_detector.connect(verbose=verbose)
-        self.clap_detector.listen(verbose=verbose)
+        try:
+            self.clap_detector.listen(verbose=verbose)
+        finally:
+            self.scheduler.close()
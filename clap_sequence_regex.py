@@ -1,28 +1,32 @@
 import asyncio
-from typing import Callable, Optional, Awaitable
+from typing import Callable, Optional, Awaitable, Union
 import threading
 from clap_detector import ClapDetector
-from constants import CHUNK
-from settings import Settings, default_settings
+from metrics import Metrics
+from settings import Settings, PhysicalSettings, default_settings
 
 from fsm import notifier, regular_expressions as rex
-from fsm.deterministic_finite_state_machine import DFSMachine
+from fsm.bit_parallel import make_machine
 
 
 class ClapSequenceRegex:
     def __init__(self,
                  generate_regex: Callable[[notifier.Notifier], Awaitable[rex.RegularExpression]],
-                 settings: Settings = default_settings):
-        self.clappy = ClapDetector(self.on_clap, settings=settings)
+                 settings: Union[Settings, PhysicalSettings] = default_settings,
+                 metrics: Optional[Metrics] = None,
+                 engine: str = 'dfa'):
+        self.clappy = ClapDetector(self.on_clap, settings=settings, metrics=metrics)
+        self.metrics = metrics
 
         self.generate_regex = generate_regex
+        self.engine = engine
 
         self.clap_notifier: Optional[notifier.Notifier] = None
         self.machine_loop: Optional[asyncio.AbstractEventLoop] = None
         self.termination_notifier: Optional[asyncio.Lock] = None
 
     def on_clap(self, clap_frame_number):
-        fps = self.clappy.sample_rate / CHUNK
+        fps = self.clappy.frames_per_second
         clap_time = clap_frame_number / fps
 
         if self.clap_notifier is not None:
@@ -40,9 +44,9 @@ class ClapSequenceRegex:
             await self.termination_notifier.acquire()
 
             regex = await self.generate_regex(self.clap_notifier)
-            machine = DFSMachine.from_regular_expression(regex)
+            machine = make_machine(regex, self.engine)
 
-            run_machine_task = asyncio.create_task(machine.run())
+            run_machine_task = asyncio.create_task(machine.run(self.metrics))
 
             await asyncio.wait([
                 run_machine_task,
@@ -1,8 +1,12 @@
-import pyaudio
-
-FORMAT = pyaudio.paInt16
+# pyaudio.paInt16, spelled out so that importing the constants does not load PortAudio
+FORMAT = 8
 CHANNELS = 1
 CHUNK = 1 << 12
 AMPLITUDES_HISTORY_SECONDS = 1
+# a peak must be at least this many frames old before it counts as a clap
+PEAK_MARGIN_FRAMES = 3
 
 AUTO_THRESHOLD_FRACTION = 0.65
+
+# port of the websocket relay (relay_server.py)
+RELAY_PORT = 8765
@@ -0,0 +1,202 @@
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from queue import Queue, Empty, Full
+from typing import Callable, Awaitable, Optional, Union, TYPE_CHECKING
+
+import numpy as np
+
+from clap_detector import ClapDetector
+from constants import *
+from fft_backend import FFTBackend
+from fsm import notifier, regular_expressions as rex
+from fsm.bit_parallel import make_machine
+from settings import Settings, PhysicalSettings, default_settings
+
+if TYPE_CHECKING:
+    # imported in connect, like ClapDetector does
+    import pyaudio
+
+
+@dataclass
+class Room:
+    name: str
+    device_name: str
+    generate_regex: Callable[[notifier.Notifier], Awaitable[rex.RegularExpression]] = field(repr=False)
+    settings: Union[Settings, PhysicalSettings] = default_settings
+
+
+class DetectorManager:
+    """
+    Runs clap detection for several rooms in one process.
+
+    All input devices share one PortAudio instance, and each stream hands its chunks to PortAudio's callback thread,
+    which only queues them. One DSP thread drains whatever chunks are ready, computes the FFTs of all those of the
+    same length and FFT backend in a single batched call, and steps each room's detector in arrival order. Claps are
+    fed to per-room state machines that all run on one event loop.
+
+    If the DSP thread fails, the streams are stopped and ``listen`` raises its error.
+    """
+
+    def __init__(self, rooms: list[Room], *, fft: Optional[FFTBackend] = None, max_queued_chunks: int = 64,
+                 engine: str = 'dfa'):
+        """
+        :param fft: shared by every room's detector, so that their chunks can be batched together
+        :param max_queued_chunks: chunks waiting for DSP before the oldest are dropped
+        :param engine: runs the gestures; see ``fsm.bit_parallel.make_machine``
+        """
+        self.rooms = rooms
+        self.audio: Optional['pyaudio.PyAudio'] = None
+        self.fft = FFTBackend() if fft is None else fft
+        self.detectors: list[ClapDetector] = [
+            ClapDetector(self.clap_callback(room_index), settings=room.settings, fft=self.fft)
+            for room_index, room in enumerate(rooms)
+        ]
+        self.streams: list['pyaudio.Stream'] = []
+        self.chunk_queue: Queue[Optional[tuple[int, np.ndarray]]] = Queue(max_queued_chunks)
+        self.engine = engine
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.clap_notifiers: list[notifier.Notifier] = []
+        self.stopping: Optional[asyncio.Event] = None
+        # set by the DSP thread if it fails
+        self.dsp_error: Optional[BaseException] = None
+
+    def clap_callback(self, room_index: int) -> Callable[[int], None]:
+        def on_clap(clap_frame_number):
+            if self.clap_notifiers and not self.loop.is_closed():
+                asyncio.run_coroutine_threadsafe(self.clap_notifiers[room_index].notify(), self.loop)
+
+        return on_clap
+
+    def connect(self, verbose: bool = False):
+        import pyaudio
+
+        self.audio = pyaudio.PyAudio()
+        for room, detector in zip(self.rooms, self.detectors):
+            detector.connect(verbose=verbose, device_name=room.device_name, audio=self.audio)
+
+    def enqueue(self, item: Optional[tuple[int, np.ndarray]]):
+        # dropping the oldest chunk if the DSP thread has fallen behind
+        while True:
+            try:
+                self.chunk_queue.put_nowait(item)
+                return
+            except Full:
+                try:
+                    self.chunk_queue.get_nowait()
+                except Empty:
+                    pass
+
+    def open_streams(self):
+        import pyaudio
+
+        for room_index, detector in enumerate(self.detectors):
+            def stream_callback(in_data, frame_count, time_info, status, room_index=room_index):
+                if self.dsp_error is not None:
+                    return None, pyaudio.paAbort
+                self.enqueue((room_index, np.frombuffer(in_data, dtype=np.int16)))
+                return None, pyaudio.paContinue
+
+            self.streams.append(self.audio.open(format=FORMAT, channels=detector.channels,
+                                                rate=detector.sample_rate, input=True,
+                                                input_device_index=detector.device_info['index'],
+                                                frames_per_buffer=detector.chunk,
+                                                stream_callback=stream_callback))
+
+    def close_streams(self):
+        for stream in self.streams:
+            stream.stop_stream()
+            stream.close()
+        self.streams = []
+        for detector in self.detectors:
+            if detector.profile_watch is not None:
+                detector.profile_watch.set()
+        self.audio.terminate()
+
+    def process_batch(self, chunks: list[tuple[int, np.ndarray]], *, verbose=False):
+        """
+        Step each room's detector on its chunks, in arrival order.
+
+        :param chunks: (room index, interleaved chunk) pairs
+        """
+        # every channel of every chunk of the same length and backend, stacked into one FFT; a room's chunks always
+        # share a group, so each room still sees them in order
+        groups: dict[tuple[int, int], list[tuple[ClapDetector, np.ndarray]]] = {}
+        for room_index, chunk in chunks:
+            detector = self.detectors[room_index]
+            channel_chunk = detector.split_channels(chunk)
+            groups.setdefault((id(detector.fft), channel_chunk.shape[-1]), []).append((detector, channel_chunk))
+
+        for group in groups.values():
+            spectra = group[0][0].fft.magnitudes(np.concatenate([channel_chunk for _, channel_chunk in group]))
+            start = 0
+            for detector, channel_chunk in group:
+                end = start + channel_chunk.shape[0]
+                detector.record_spectrum(spectra[start:end])
+                detector.process_frame(verbose=verbose)
+                start = end
+
+    def process_chunks(self, *, verbose=False):
+        while True:
+            batch = [self.chunk_queue.get()]
+            try:
+                while batch[-1] is not None:
+                    batch.append(self.chunk_queue.get_nowait())
+            except Empty:
+                pass
+
+            chunks = [item for item in batch if item is not None]
+            if chunks:
+                self.process_batch(chunks, verbose=verbose)
+
+            if batch[-1] is None:
+                return
+
+    def run_dsp(self, *, verbose=False):
+        try:
+            self.process_chunks(verbose=verbose)
+        except Exception as ex:
+            self.dsp_error = ex
+            if self.stopping is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def run_machines(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        if self.dsp_error is not None:
+            return
+        notifiers = [notifier.Notifier(f'clap {room.name}') for room in self.rooms]
+        machines = [
+            make_machine(await room.generate_regex(clap_notifier), self.engine)
+            for room, clap_notifier in zip(self.rooms, notifiers)
+        ]
+        self.clap_notifiers = notifiers
+
+        running = asyncio.gather(*(machine.run() for machine in machines))
+        stopping = asyncio.create_task(self.stopping.wait())
+        try:
+            await asyncio.wait([running, stopping], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            running.cancel()
+            stopping.cancel()
+            await asyncio.gather(running, stopping, return_exceptions=True)
+
+    def listen(self, *, verbose=False):
+        dsp_thread = threading.Thread(target=lambda: self.run_dsp(verbose=verbose))
+        dsp_thread.start()
+        self.open_streams()
+
+        try:
+            asyncio.run(self.run_machines())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.clap_notifiers = []
+            self.close_streams()
+            self.enqueue(None)
+            dsp_thread.join()
+            print('done')
+
+        if self.dsp_error is not None:
+            raise RuntimeError('clap detection failed') from self.dsp_error
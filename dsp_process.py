@@ -0,0 +1,126 @@
+import dataclasses
+import multiprocessing
+import signal
+import traceback
+from multiprocessing.connection import Connection
+from typing import Optional, Any
+
+import numpy as np
+
+from clap_detector import ClapDetector
+from fft_backend import make_fft_backend
+
+
+def detector_config(detector: ClapDetector) -> dict[str, Any]:
+    """
+    Keyword arguments rebuilding ``detector`` in another process, from its settings as given rather than as applied.
+    """
+    settings = detector.physical_settings if detector.physical_settings is not None else detector.settings
+    if detector.adaptive_threshold is not None:
+        settings = dataclasses.replace(settings, threshold='adaptive')
+    if detector.auto_threshold or settings.threshold == 'auto':
+        raise ValueError("the 'auto' threshold is switched off from the main process, so cannot run in a DSP process")
+    if detector.recorder is not None or detector.metrics is not None or detector.classifier is not None:
+        print('The recorder, metrics and classifier are not used by the DSP process')
+
+    return {
+        'settings': settings,
+        'chunk': detector.chunk,
+        'sample_rate': detector.sample_rate,
+        'channels': detector.channels,
+        'min_coincident_channels': detector.min_coincident_channels,
+        'coincidence_frames': detector.coincidence_frames,
+        'profiles': detector.profiles,
+        'threshold_override': detector.threshold_override,
+        'use_profile_classifier': detector.use_profile_classifier,
+        'fft_name': detector.fft.name,
+        'float32': detector.fft.dtype == np.float32,
+        'workers': getattr(detector.fft, 'workers', 1),
+    }
+
+
+def run_detector(config: dict[str, Any], device_name: str, events: Connection, stop: multiprocessing.Event,
+                 verbose: bool):
+    """
+    The DSP process: capture and detect, sending each clap's frame number down ``events`` until ``stop`` is set.
+    """
+    # the main process shuts this one down, so that the profile is still saved on Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    config = dict(config)
+    fft = make_fft_backend(config.pop('fft_name'), float32=config.pop('float32'), workers=config.pop('workers'))
+    detector = ClapDetector(events.send, fft=fft, **config)
+
+    try:
+        detector.connect(verbose=verbose, device_name=device_name)
+        detector.frame_count = 0
+        detector.last_clap = 0
+
+        stream = detector.stream()
+        for chunk in stream:
+            detector.record_chunk(chunk)
+            detector.process_frame(verbose=verbose)
+            if stop.is_set():
+                stream.stop()
+                break
+
+        if detector.profiles is not None:
+            detector.save_profile()
+    except Exception as ex:
+        events.send(('error', ''.join(traceback.format_exception(type(ex), ex, ex.__traceback__))))
+    finally:
+        events.close()
+
+
+class DetectorProcess:
+    """
+    Runs capture and clap detection in a separate process, so that nothing else in the main process can hold the GIL
+    while a chunk is due. Clap frame numbers come back over a pipe, whose file descriptor can be watched by an event
+    loop.
+    """
+
+    def __init__(self, detector: ClapDetector, *, device_name: str = 'default', verbose: bool = False):
+        """
+        :param detector: configured, but not connected; the process runs a copy of it
+        """
+        self.config = detector_config(detector)
+        self.device_name = device_name
+        self.verbose = verbose
+
+        self.context = multiprocessing.get_context('spawn')
+        self.events, self.child_events = self.context.Pipe(duplex=False)
+        self.stopping = self.context.Event()
+        self.process: Optional[multiprocessing.Process] = None
+
+    def start(self):
+        self.process = self.context.Process(
+            target=run_detector,
+            args=(self.config, self.device_name, self.child_events, self.stopping, self.verbose),
+            name='clappy-dsp',
+            daemon=True
+        )
+        self.process.start()
+        # the child holds the only sending end now, so that its exit shows up as EOF
+        self.child_events.close()
+
+    def read_events(self) -> list[int]:
+        """
+        :return: the clap frame numbers waiting in the pipe, without blocking
+        :raise EOFError: once the process has exited and every event has been read
+        """
+        claps = []
+        while self.events.poll():
+            event = self.events.recv()
+            if isinstance(event, tuple) and event[0] == 'error':
+                print(f'DSP process failed:\n{event[1]}')
+            else:
+                claps.append(event)
+        return claps
+
+    def stop(self):
+        self.stopping.set()
+
+    def join(self):
+        self.process.join()
+
+    def close(self):
+        self.events.close()
@@ -0,0 +1,127 @@
+from typing import Optional
+
+import numpy as np
+
+
+class FFTBackend:
+    """
+    Computes the magnitude spectrum of each channel of a chunk.
+
+    ``magnitudes`` returns a buffer that is reused by the next call, so per-chunk processing allocates as little as the
+    backend allows. Buffers are allocated on the first chunk of each shape.
+    """
+    name = 'numpy'
+
+    def __init__(self, dtype=np.float64):
+        """
+        :param dtype: np.float32 halves memory traffic; magnitudes are then only accurate to about 1e-6
+        """
+        self.dtype = np.dtype(dtype)
+        self.magnitude_buffer: Optional[np.ndarray] = None
+
+    def magnitude_out(self, shape: tuple[int, ...]) -> np.ndarray:
+        if self.magnitude_buffer is None or self.magnitude_buffer.shape != shape:
+            self.magnitude_buffer = np.empty(shape, dtype=self.dtype)
+        return self.magnitude_buffer
+
+    def magnitudes(self, samples: np.ndarray) -> np.ndarray:
+        """
+        :param samples: (channels, samples)
+        :return: (channels, samples // 2 + 1)
+        """
+        spectrum = np.fft.rfft(samples.astype(self.dtype, copy=False), axis=-1)
+        return np.abs(spectrum, out=self.magnitude_out(spectrum.shape))
+
+
+class ScipyFFT(FFTBackend):
+    """
+    ``scipy.fft``, which keeps float32 input in single precision and can split channels across ``workers`` threads.
+    The samples are converted into a preallocated input buffer, which the FFT may then overwrite.
+    """
+    name = 'scipy'
+
+    def __init__(self, dtype=np.float64, workers: int = 1):
+        super().__init__(dtype)
+        import scipy.fft
+
+        self.rfft = scipy.fft.rfft
+        self.workers = workers
+        self.input_buffer: Optional[np.ndarray] = None
+
+    def magnitudes(self, samples: np.ndarray) -> np.ndarray:
+        if self.input_buffer is None or self.input_buffer.shape != samples.shape:
+            self.input_buffer = np.empty(samples.shape, dtype=self.dtype)
+        np.copyto(self.input_buffer, samples)
+        spectrum = self.rfft(self.input_buffer, axis=-1, workers=self.workers, overwrite_x=True)
+        return np.abs(spectrum, out=self.magnitude_out(spectrum.shape))
+
+
+class PyFFTW(FFTBackend):
+    """
+    FFTW through pyFFTW, with one plan per chunk shape, made once and reused with its own aligned input and output
+    buffers.
+    """
+    name = 'pyfftw'
+
+    def __init__(self, dtype=np.float64, workers: int = 1, planner_effort: str = 'FFTW_MEASURE'):
+        super().__init__(dtype)
+        import pyfftw
+        import pyfftw.builders
+
+        self.pyfftw = pyfftw
+        self.workers = workers
+        self.planner_effort = planner_effort
+        self.plans: dict[tuple[int, ...], 'pyfftw.FFTW'] = {}
+
+    def plan(self, shape: tuple[int, ...]) -> 'pyfftw.FFTW':
+        if shape not in self.plans:
+            # planning with FFTW_MEASURE scribbles over the input, so it happens before any samples are copied in
+            input_array = self.pyfftw.empty_aligned(shape, dtype=self.dtype)
+            self.plans[shape] = self.pyfftw.builders.rfft(
+                input_array, axis=-1, overwrite_input=True, threads=self.workers, planner_effort=self.planner_effort
+            )
+        return self.plans[shape]
+
+    def magnitudes(self, samples: np.ndarray) -> np.ndarray:
+        plan = self.plan(samples.shape)
+        np.copyto(plan.input_array, samples)
+        spectrum = plan()
+        return np.abs(spectrum, out=self.magnitude_out(spectrum.shape))
+
+
+FFT_BACKENDS = {backend.name: backend for backend in (FFTBackend, ScipyFFT, PyFFTW)}
+
+
+def make_fft_backend(name: str = 'numpy', *, float32: bool = False, workers: int = 1) -> FFTBackend:
+    """
+    :param name: 'numpy', 'scipy', 'pyfftw', or 'auto' for pyfftw if it is installed and scipy otherwise
+    """
+    dtype = np.float32 if float32 else np.float64
+    if name == 'auto':
+        try:
+            return PyFFTW(dtype, workers)
+        except ImportError:
+            return ScipyFFT(dtype, workers)
+    if name not in FFT_BACKENDS:
+        raise ValueError(f'Unknown FFT backend {name!r}, expected one of {", ".join(FFT_BACKENDS)} or auto')
+    if name == 'numpy':
+        return FFTBackend(dtype)
+    return FFT_BACKENDS[name](dtype, workers)
+
+
+def gaussian_weights(bin_count: int, sigma: float, index: int, truncate: float = 4.0) -> np.ndarray:
+    """
+    Weights ``w`` such that ``spectrum @ w == gaussian_filter1d(spectrum, sigma)[index]``, with scipy's default
+    'reflect' boundary mode. Smoothing the whole spectrum just to read one bin is most of the per-chunk DSP cost.
+    """
+    radius = int(truncate * sigma + 0.5)
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel /= kernel.sum()
+
+    # 'reflect' extends the input as ... c b a | a b c ... c | c b a ...
+    positions = (index + offsets) % (2 * bin_count)
+    positions = np.where(positions >= bin_count, 2 * bin_count - 1 - positions, positions)
+    weights = np.zeros(bin_count)
+    np.add.at(weights, positions, kernel)
+    return weights
@@ -0,0 +1,166 @@
+"""
+Runs an ``NFSMachine`` directly, without determinizing it first.
+
+The active NStates are one integer, a bit per state. Epsilon closures are computed when the machine is built, for the
+states events lead to, so following an event is an OR of the closed successors of each active state. Those are looked up
+a byte of the active mask at a time, in tables filled in as byte values are first seen, so a step costs a few integer
+operations per eight states however the states combine. Building is just numbering the states, where ``DFSMachine``
+has to enumerate every reachable set of them, so this suits large or often edited grammars.
+"""
+import time
+from typing import Union, Optional
+
+from fsm import events
+from fsm.actions import Action
+from fsm.deterministic_finite_state_machine import DFSMachine
+from fsm.finite_state_machine import NState, epsilon
+from fsm.regular_expressions import RegularExpression
+
+# an active mask, and the actions run on reaching it
+Step = tuple[int, frozenset[Action]]
+NO_ACTIONS: frozenset[Action] = frozenset()
+
+
+class BitParallelMachine:
+    def __init__(self, n_start: NState):
+        # number every reachable state
+        states = [n_start]
+        numbers = {n_start: 0}
+        for state in states:
+            for targets in state.transitions.values():
+                for target in targets:
+                    if target not in numbers:
+                        numbers[target] = len(states)
+                        states.append(target)
+        self.state_count = len(states)
+
+        # epsilon closures, and the actions on the epsilon transitions within them; only the start and the targets of
+        # events are ever entered, so only theirs are needed
+        closures: dict[NState, Step] = {}
+
+        def closure_of(state: NState) -> Step:
+            if state not in closures:
+                closure = 1 << numbers[state]
+                actions: set[Action] = set()
+                unexplored = [state]
+                while unexplored:
+                    for target, target_actions in unexplored.pop().transitions.get(epsilon, {}).items():
+                        actions.update(target_actions)
+                        if not closure >> numbers[target] & 1:
+                            closure |= 1 << numbers[target]
+                            unexplored.append(target)
+                closures[state] = (closure, frozenset(actions))
+            return closures[state]
+
+        self.events: list[events.Event] = list(dict.fromkeys(
+            event for state in states for event in state.transitions if event != epsilon
+        ))
+        self.event_indices = {event: index for index, event in enumerate(self.events)}
+        # the states with a transition on each event
+        self.event_masks = [0] * len(self.events)
+        # for each event, the closed successors of each state, and the actions on the way
+        self.successors: list[list[Step]] = [[(0, NO_ACTIONS)] * self.state_count for _ in self.events]
+        for number, state in enumerate(states):
+            for event, targets in state.transitions.items():
+                if event == epsilon:
+                    continue
+                event_index = self.event_indices[event]
+                self.event_masks[event_index] |= 1 << number
+                mask = 0
+                actions = set()
+                for target, target_actions in targets.items():
+                    closure, closure_actions = closure_of(target)
+                    mask |= closure
+                    actions.update(target_actions)
+                    actions.update(closure_actions)
+                self.successors[event_index][number] = (mask, frozenset(actions))
+
+        # byte_tables[event][byte position][byte value], filled in by step
+        byte_count = (self.state_count + 7) // 8
+        self.byte_tables: list[list[list[Optional[Step]]]] = [
+            [[(0, NO_ACTIONS)] + [None] * 255 for _ in range(byte_count)] for _ in self.events
+        ]
+        self.start, self.initial_actions = closure_of(n_start)
+
+    @classmethod
+    def from_regular_expression(cls, regex: RegularExpression) -> 'BitParallelMachine':
+        return cls(regex.to_fsm().start)
+
+    def byte_step(self, event_index: int, position: int, byte: int) -> Step:
+        mask = 0
+        actions: set[Action] = set()
+        for bit in range(8):
+            if byte >> bit & 1:
+                bit_mask, bit_actions = self.successors[event_index][position * 8 + bit]
+                mask |= bit_mask
+                actions.update(bit_actions)
+        step = (mask, frozenset(actions) if actions else NO_ACTIONS)
+        self.byte_tables[event_index][position][byte] = step
+        return step
+
+    def step(self, active: int, event_index: int) -> Step:
+        """
+        :return: the states active after the event, and the actions to run
+        """
+        tables = self.byte_tables[event_index]
+        active &= self.event_masks[event_index]
+        next_active = 0
+        actions = NO_ACTIONS
+        position = 0
+        while active:
+            byte = active & 0xff
+            if byte:
+                byte_step = tables[position][byte] or self.byte_step(event_index, position, byte)
+                next_active |= byte_step[0]
+                if byte_step[1]:
+                    actions = actions | byte_step[1]
+            active >>= 8
+            position += 1
+        return next_active, actions
+
+    def awaited_events(self, active: int) -> list[int]:
+        return [index for index, mask in enumerate(self.event_masks) if active & mask]
+
+    async def run(self, metrics=None):
+        """
+        As ``DFSMachine.run``, which this runs the same actions as, on the same events.
+        """
+        if metrics is not None:
+            transitions = metrics.counter('clappy_fsm_transitions_total', 'state machine transitions')
+            action_time = metrics.histogram('clappy_action_seconds', 'time spent running transition actions')
+
+        for action in self.initial_actions:
+            await action.run()
+
+        active = self.start
+
+        while event_indices := self.awaited_events(active):
+            first_event = await events.first_event(self.events[index] for index in event_indices)
+
+            active, actions = self.step(active, self.event_indices[first_event])
+            if metrics is None:
+                for action in actions:
+                    await action.run()
+            else:
+                transitions.inc()
+                start = time.perf_counter()
+                for action in actions:
+                    await action.run()
+                action_time.observe(time.perf_counter() - start)
+
+
+ENGINES = ('dfa', 'nfa')
+
+
+def make_machine(program: Union[RegularExpression, DFSMachine],
+                 engine: str = 'dfa') -> Union[DFSMachine, BitParallelMachine]:
+    """
+    :param program: as made by a ``generate_regex``
+    :param engine: 'dfa' to determinize first, or 'nfa' to run the NFA bit-parallel; machines loaded from tables are
+        already deterministic
+    """
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown engine {engine!r}, expected one of {", ".join(ENGINES)}')
+    if engine == 'nfa' and isinstance(program, RegularExpression):
+        return BitParallelMachine.from_regular_expression(program)
+    return DFSMachine.from_program(program)
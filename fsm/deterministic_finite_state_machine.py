@@ -1,4 +1,4 @@
-import asyncio
+import time
 from dataclasses import dataclass, field
 from typing import *
 
@@ -103,36 +103,72 @@ class DFSMachine:
     def from_regular_expression(cls, regex: RegularExpression):
         return cls.from_n_state(regex.to_fsm().start)
 
-    async def run(self):
+    @classmethod
+    def from_tables(cls, tables: dict, machine: str,
+                    notifications: Mapping[str, events.Event],
+                    actions: Mapping[str, Iterable[Action]]) -> 'DFSMachine':
+        """
+        Load a machine compiled by ``fsm.grammar.compile_grammar``, binding the names in it.
+
+        :param notifications: the event for each notifier name, such as ``Notifier.event()``
+        :param actions: the actions each action name runs
+        """
+        def bind(names: Iterable[str]) -> set[Action]:
+            return {action for name in names for action in actions[name]}
+
+        machine_tables = tables['machines'][machine]
+        used_notifications = {event for event in tables['events'] if isinstance(event, str)}
+        used_actions = {name for state in machine_tables['states'] for *_, names in state for name in names}
+        used_actions.update(machine_tables['initial_actions'])
+        unbound = sorted(used_notifications - notifications.keys()) + sorted(used_actions - actions.keys())
+        if unbound:
+            raise ValueError(f'Nothing is bound to {", ".join(unbound)}')
+
+        table_events = [
+            notifications[event] if isinstance(event, str) else events.Wait(event)
+            for event in tables['events']
+        ]
+        states = [DState() for _ in machine_tables['states']]
+        for state, state_tables in zip(states, machine_tables['states']):
+            for event_index, target, names in state_tables:
+                state.transitions[table_events[event_index]] = (states[target], bind(names))
+
+        return DFSMachine(bind(machine_tables['initial_actions']), states[0])
+
+    @classmethod
+    def from_program(cls, program: Union[RegularExpression, 'DFSMachine']) -> 'DFSMachine':
+        """
+        :param program: as made by a ``generate_regex``: a regular expression, or a machine already loaded from tables
+        """
+        if isinstance(program, DFSMachine):
+            return program
+        return cls.from_regular_expression(program)
+
+    async def run(self, metrics=None):
+        """
+        :param metrics: optional ``metrics.Metrics``; transitions and action run times are recorded into it
+        """
+        if metrics is not None:
+            transitions = metrics.counter('clappy_fsm_transitions_total', 'state machine transitions')
+            action_time = metrics.histogram('clappy_action_seconds', 'time spent running transition actions')
+
         for action in self.initial_actions:
             await action.run()
 
         state = self.start
 
         while state.transitions:
-            event_tasks: dict[asyncio.Task, events.Event] = {
-                asyncio.create_task(event.await_event()): event
-                for event in state.transitions
-            }
-
-            try:
+            first_event = await events.first_event(state.transitions)
 
-                done, pending = await asyncio.wait(event_tasks, return_when=asyncio.FIRST_COMPLETED)
-
-                for pending_task in pending:
-                    pending_task.cancel()
-
-                first_task = next(iter(done))
-                first_event = event_tasks[first_task]
-
-                # go to next state
-                state, actions = state.transitions[first_event]
-                # do actions
+            # go to next state
+            state, actions = state.transitions[first_event]
+            # do actions
+            if metrics is None:
                 for action in actions:
                     await action.run()
-            except asyncio.CancelledError:
-                for task in event_tasks:
-                    if not task.cancelled():
-                        task.cancel()
-
-                raise
+            else:
+                transitions.inc()
+                start = time.perf_counter()
+                for action in actions:
+                    await action.run()
+                action_time.observe(time.perf_counter() - start)
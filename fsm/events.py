@@ -1,6 +1,7 @@
 import abc
 import asyncio
 from dataclasses import dataclass, field
+from typing import Iterable
 
 
 class Event(abc.ABC):
@@ -38,3 +39,29 @@ class Wait(Event):
 
     async def await_event(self):
         await asyncio.sleep(self.seconds)
+
+
+async def first_event(events: Iterable[Event]) -> Event:
+    """
+    Wait for all of ``events`` at once, and cancel the rest when the first happens.
+
+    :return: the event that happened
+    """
+    event_tasks: dict[asyncio.Task, Event] = {
+        asyncio.create_task(event.await_event()): event
+        for event in events
+    }
+
+    try:
+        done, pending = await asyncio.wait(event_tasks, return_when=asyncio.FIRST_COMPLETED)
+
+        for pending_task in pending:
+            pending_task.cancel()
+
+        return event_tasks[next(iter(done))]
+    except asyncio.CancelledError:
+        for task in event_tasks:
+            if not task.cancelled():
+                task.cancel()
+
+        raise
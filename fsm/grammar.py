@@ -0,0 +1,391 @@
+"""
+Gestures as text, compiled ahead of time into minimal DFA tables, which ``DFSMachine.from_tables`` loads without
+building an NFA or running the subset construction.
+
+A grammar is a list of directives and rules, one per line; indented lines continue the line before, and ``#`` starts a
+comment::
+
+    wait timeout 2
+    wait long 0.75
+    every . {clap}
+
+    play_pause_left = .s.s.{play_pause}(.{left})*_
+    main = ($play_pause_left | .s.l(.{left})+_)*
+
+In expressions:
+
+- ``.`` is a clap, and ``@name`` a notification from the notifier called name; either may be followed by the actions to
+  run when it happens, as ``{action, other_action}``
+- ``~name`` waits for the wait called name, and ``_`` for ``timeout``
+- ``s`` and ``l`` say that the gap before the rest of the sequence is short or long: ``s X`` is X before ``long``, and
+  ``l X`` is a wait of ``long`` and then X; either gives up after ``timeout``
+- ``$name`` is the rule called name
+- ``*``, ``+`` and ``?`` repeat, and ``|`` and brackets group, as in regular expressions
+
+``wait name seconds`` defines a wait, and ``every . {actions}`` (or ``every @name {actions}``) adds actions to every such
+event. Every rule that no other rule refers to is compiled into a machine of its own.
+"""
+import json
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Union, Iterator
+
+from fsm import regular_expressions as rex
+from fsm.actions import Action
+from fsm.deterministic_finite_state_machine import DFSMachine, DState
+from fsm.events import Event, Wait
+
+# bump when the meaning of the tables changes; tables of other versions are rejected
+TABLES_VERSION = 1
+CLAP = 'clap'
+
+TOKEN = re.compile(r'\s+|(?P<sigil>[$@~])(?P<name>\w+)|\{(?P<actions>[^{}]*)}|(?P<op>[().|*+?_sl])')
+DIRECTIVE = re.compile(r'wait\s+(?P<wait>\w+)\s+(?P<seconds>\S+)|every\s+(?P<every>\.|@\w+)\s*\{(?P<actions>[^{}]*)}')
+RULE = re.compile(r'(?P<rule>\w+)\s*=(?P<expression>.*)')
+
+
+class GrammarError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Notification(Event):
+    """
+    A notifier's event, by name, until the tables are bound to real notifiers.
+    """
+    name: str
+
+    async def await_event(self):
+        raise TypeError('grammar events only name notifiers; bind them with DFSMachine.from_tables')
+
+
+@dataclass(frozen=True)
+class NamedAction(Action):
+    name: str
+
+    async def run(self):
+        raise TypeError('grammar actions are only names; bind them with DFSMachine.from_tables')
+
+
+def parse_actions(text: str) -> frozenset[str]:
+    names = [name.strip() for name in text.split(',') if name.strip()]
+    for name in names:
+        if not re.fullmatch(r'\w+', name):
+            raise GrammarError(f'Bad action name {name!r}')
+    return frozenset(names)
+
+
+@dataclass
+class Grammar:
+    waits: dict[str, float] = field(default_factory=dict)
+    # actions added to every event of a notifier
+    every: dict[str, frozenset[str]] = field(default_factory=dict)
+    rules: dict[str, str] = field(default_factory=dict)
+
+    @staticmethod
+    def parse(text: str) -> 'Grammar':
+        lines: list[str] = []
+        for line in text.splitlines():
+            line = line.split('#', 1)[0].rstrip()
+            if not line:
+                continue
+            if line[0].isspace() and lines:
+                lines[-1] += ' ' + line.strip()
+            else:
+                lines.append(line.strip())
+
+        grammar = Grammar()
+        for line in lines:
+            if directive := DIRECTIVE.fullmatch(line):
+                if directive['wait'] is not None:
+                    try:
+                        grammar.waits[directive['wait']] = float(directive['seconds'])
+                    except ValueError:
+                        raise GrammarError(f'Bad wait {line!r}') from None
+                else:
+                    notifier_name = CLAP if directive['every'] == '.' else directive['every'][1:]
+                    grammar.every[notifier_name] = grammar.every.get(notifier_name, frozenset()) | parse_actions(
+                        directive['actions'])
+            elif rule := RULE.fullmatch(line):
+                if rule['rule'] in grammar.rules:
+                    raise GrammarError(f'Rule {rule["rule"]} is defined twice')
+                grammar.rules[rule['rule']] = rule['expression']
+            else:
+                raise GrammarError(f'Expected a rule, or a wait or every directive: {line!r}')
+        return grammar
+
+    def references(self, rule: str) -> set[str]:
+        return {token['name'] for token in tokenize(self.rules[rule]) if token['sigil'] == '$'}
+
+    def roots(self) -> list[str]:
+        referenced = {name for rule in self.rules for name in self.references(rule)}
+        return [rule for rule in self.rules if rule not in referenced]
+
+    def expression(self, rule: str) -> rex.RegularExpression:
+        return Parser(self, rule, ()).parse()
+
+    def wait(self, name: str) -> float:
+        if name not in self.waits:
+            raise GrammarError(f'No wait called {name}; add "wait {name} <seconds>"')
+        return self.waits[name]
+
+
+def tokenize(text: str) -> Iterator[re.Match]:
+    position = 0
+    while position < len(text):
+        token = TOKEN.match(text, position)
+        if token is None:
+            raise GrammarError(f'Unexpected {text[position:]!r}')
+        position = token.end()
+        if not token[0].isspace():
+            yield token
+
+
+class Parser:
+    """
+    Recursive descent over one rule, into ``rex`` combinators.
+    """
+
+    def __init__(self, grammar: Grammar, rule: str, rule_stack: tuple[str, ...]):
+        if rule not in grammar.rules:
+            raise GrammarError(f'No rule called {rule}')
+        if rule in rule_stack:
+            raise GrammarError(f'Rule {rule} refers to itself: {" -> ".join([*rule_stack, rule])}')
+        self.grammar = grammar
+        self.rule = rule
+        self.rule_stack = (*rule_stack, rule)
+        self.tokens = list(tokenize(grammar.rules[rule]))
+        self.position = 0
+
+    def peek(self) -> Optional[str]:
+        if self.position == len(self.tokens):
+            return None
+        token = self.tokens[self.position]
+        return token['op'] or token['sigil'] or '{'
+
+    def next(self) -> re.Match:
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self) -> rex.RegularExpression:
+        expression = self.alternatives()
+        if self.peek() is not None:
+            raise GrammarError(f'Unexpected {self.tokens[self.position][0]!r} in rule {self.rule}')
+        return expression
+
+    def alternatives(self) -> rex.RegularExpression:
+        alternatives = [self.sequence()]
+        while self.peek() == '|':
+            self.next()
+            alternatives.append(self.sequence())
+        return alternatives[0] if len(alternatives) == 1 else rex.Or(alternatives)
+
+    def sequence(self) -> rex.RegularExpression:
+        expressions = []
+        while self.peek() not in (None, '|', ')'):
+            if self.peek() in ('s', 'l'):
+                gap = self.next()['op']
+                if self.peek() in (None, '|', ')'):
+                    raise GrammarError(f'Nothing follows the gap {gap!r} in rule {self.rule}')
+                expressions.append(self.gap(gap, self.sequence()))
+            else:
+                expressions.append(self.repetition())
+        return expressions[0] if len(expressions) == 1 else rex.Sequence(expressions)
+
+    def gap(self, gap: str, expression: rex.RegularExpression) -> rex.RegularExpression:
+        timeout, long = self.grammar.wait('timeout'), self.grammar.wait('long')
+        long_wait = rex.Event(Wait(long))
+        give_up = rex.Event(Wait(timeout - long))
+        if gap == 's':
+            return expression | long_wait >> give_up
+        return long_wait >> (expression | give_up)
+
+    def repetition(self) -> rex.RegularExpression:
+        expression = self.atom()
+        while self.peek() in ('*', '+', '?'):
+            operator = self.next()['op']
+            if operator == '*':
+                expression = rex.Many(expression)
+            elif operator == '+':
+                expression = rex.Some(expression)
+            else:
+                expression = rex.OptionalExpr(expression)
+        return expression
+
+    def atom(self) -> rex.RegularExpression:
+        if self.peek() is None:
+            raise GrammarError(f'Rule {self.rule} ends too soon')
+        token = self.next()
+        if token['op'] == '.':
+            return self.notification(CLAP)
+        if token['op'] == '_':
+            return rex.Event(Wait(self.grammar.wait('timeout')))
+        if token['op'] == '(':
+            expression = self.alternatives()
+            if self.peek() != ')':
+                raise GrammarError(f'Unclosed bracket in rule {self.rule}')
+            self.next()
+            return expression
+        if token['sigil'] == '@':
+            return self.notification(token['name'])
+        if token['sigil'] == '~':
+            return rex.Event(Wait(self.grammar.wait(token['name'])))
+        if token['sigil'] == '$':
+            return Parser(self.grammar, token['name'], self.rule_stack).parse()
+        raise GrammarError(f'Unexpected {token[0]!r} in rule {self.rule}')
+
+    def notification(self, name: str) -> rex.Event:
+        actions = self.grammar.every.get(name, frozenset())
+        if self.peek() == '{':
+            actions |= parse_actions(self.next()['actions'])
+        return rex.Event(Notification(name), frozenset(NamedAction(action) for action in actions))
+
+
+EventKey = Union[str, float]
+
+
+def event_key(event: Event) -> EventKey:
+    """
+    Notifications are saved by notifier name, and waits by their length in seconds.
+    """
+    if isinstance(event, Notification):
+        return event.name
+    if isinstance(event, Wait):
+        return float(event.seconds)
+    raise GrammarError(f'{event} cannot be saved in tables')
+
+
+def sort_key(key: EventKey):
+    return not isinstance(key, str), key
+
+
+def minimize(machine: DFSMachine) -> dict:
+    """
+    The minimal machine equivalent to ``machine``, as tables: states that run the same actions on the same events, to
+    equivalent states, are merged. States are numbered breadth first from the start, in event order, so the same
+    grammar always compiles to the same tables.
+    """
+    # number the reachable states
+    states: list[DState] = [machine.start]
+    numbers = {machine.start: 0}
+    for state in states:
+        for event in sorted(state.transitions, key=lambda event: sort_key(event_key(event))):
+            next_state = state.transitions[event][0]
+            if next_state not in numbers:
+                numbers[next_state] = len(states)
+                states.append(next_state)
+    transitions = [
+        {
+            event_key(event): (numbers[next_state], tuple(sorted(action.name for action in actions)))
+            for event, (next_state, actions) in state.transitions.items()
+        }
+        for state in states
+    ]
+
+    # partition refinement: split blocks until states in a block always step to the same blocks
+    blocks = [0] * len(states)
+    block_count = 1
+    while True:
+        signatures: dict[tuple, int] = {}
+        refined = [
+            signatures.setdefault(
+                (blocks[number], tuple(sorted(
+                    ((key, blocks[target], actions) for key, (target, actions) in state_transitions.items()),
+                    key=lambda transition: sort_key(transition[0])
+                ))),
+                len(signatures)
+            )
+            for number, state_transitions in enumerate(transitions)
+        ]
+        blocks = refined
+        if len(signatures) == block_count:
+            break
+        block_count = len(signatures)
+
+    # renumber the blocks breadth first, starting from the start state's
+    order = [blocks[0]]
+    block_numbers = {blocks[0]: 0}
+    representatives = {}
+    for number, block in enumerate(blocks):
+        representatives.setdefault(block, number)
+    minimal_states = []
+    for block in order:
+        state_transitions = transitions[representatives[block]]
+        minimal_transitions = {}
+        for key in sorted(state_transitions, key=sort_key):
+            target, actions = state_transitions[key]
+            if blocks[target] not in block_numbers:
+                block_numbers[blocks[target]] = len(order)
+                order.append(blocks[target])
+            minimal_transitions[key] = (block_numbers[blocks[target]], actions)
+        minimal_states.append(minimal_transitions)
+
+    return {
+        'initial_actions': sorted(action.name for action in machine.initial_actions),
+        'states': minimal_states,
+    }
+
+
+def compile_grammar(text: str, rules: Optional[list[str]] = None) -> dict:
+    """
+    :param rules: the rules to compile into machines; by default, every rule no other rule refers to
+    :return: tables for ``save_tables`` and ``DFSMachine.from_tables``
+    """
+    grammar = Grammar.parse(text)
+    # every rule is checked, even those only compiled as part of another
+    for rule in grammar.rules:
+        grammar.expression(rule)
+    rules = grammar.roots() if rules is None else rules
+    if not rules:
+        raise GrammarError('No rules to compile')
+    machines = {rule: minimize(DFSMachine.from_regular_expression(grammar.expression(rule))) for rule in rules}
+
+    # one list of events for all machines, which transitions refer to by index
+    events = sorted({key for machine in machines.values() for state in machine['states'] for key in state},
+                    key=sort_key)
+    event_indices = {key: index for index, key in enumerate(events)}
+    return {
+        'version': TABLES_VERSION,
+        'events': events,
+        'machines': {
+            rule: {
+                'initial_actions': machine['initial_actions'],
+                'states': [
+                    [[event_indices[key], target, list(actions)] for key, (target, actions) in state.items()]
+                    for state in machine['states']
+                ],
+            }
+            for rule, machine in machines.items()
+        },
+    }
+
+
+def action_names(tables: dict) -> set[str]:
+    return {
+        name
+        for machine in tables['machines'].values()
+        for names in [machine['initial_actions'], *(names for state in machine['states'] for *_, names in state)]
+        for name in names
+    }
+
+
+def save_tables(tables: dict, path: str):
+    Path(path).write_text(json.dumps(tables, separators=(',', ':')))
+
+
+def load_tables(path: str) -> dict:
+    tables = json.loads(Path(path).read_text())
+    if tables.get('version') != TABLES_VERSION:
+        raise GrammarError(f'{path} was compiled by version {tables.get("version")}, expected {TABLES_VERSION}')
+    return tables
+
+
+def load_gestures(path: str) -> dict:
+    """
+    Tables from a compiled ``.json`` file, or compiled now from a grammar.
+    """
+    if path.endswith('.json'):
+        return load_tables(path)
+    return compile_grammar(Path(path).read_text())
@@ -0,0 +1,26 @@
+import subprocess
+
+
+def press(device, key):
+    for value in (1, 0):
+        subprocess.run(
+            ['/usr/bin/env',
+             'evemu-event',
+             device,
+             '--type', 'EV_KEY',
+             '--code', key,
+             '--value', str(value),
+             '--sync'
+             ]
+        )
+
+
+def set_mic(un_muted: bool):
+    subprocess.run(
+        ['/usr/bin/env',
+         'amixer',
+         'set',
+         'Capture',
+         'cap' if un_muted else 'nocap'
+         ], stdout=subprocess.PIPE
+    )
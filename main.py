@@ -1,208 +1,369 @@
 #!/usr/bin/python3
-import asyncio
-import dataclasses
-import functools
-from dataclasses import dataclass
-import time
-from threading import Thread
-from typing import Union, Optional, Tuple, Callable
-
-import settings
-from clap_sequence_binary import ClapSequenceBinary
-from clap_sequence_regex import ClapSequenceRegex
-import subprocess
-import fire
-
-import fsm.regular_expressions as rex
-from fsm.events import Wait
-from fsm.actions import Print, Action
-from fsm.notifier import Notifier
-from websocket_listener import WebSocketListener
+"""
+Subcommands import what they need when they run, so ``main.py relay`` or ``main.py websocket`` never loads numpy,
+scipy or PortAudio, and ``main.py --help`` stays fast.
+"""
 from pathlib import Path
-
-
-def press(device, key):
-    for value in (1, 0):
-        subprocess.run(
-            ['/usr/bin/env',
-             'evemu-event',
-             device,
-             '--type', 'EV_KEY',
-             '--code', key,
-             '--value', str(value),
-             '--sync'
-             ]
-        )
-
-
-def set_mic(un_muted: bool):
-    subprocess.run(
-        ['/usr/bin/env',
-         'amixer',
-         'set',
-         'Capture',
-         'cap' if un_muted else 'nocap'
-         ], stdout=subprocess.PIPE
-    )
-
-
-@dataclass(frozen=True)
-class Press(Action):
-    key: str
-    device: str
-    loop: asyncio.AbstractEventLoop
-
-    async def run(self):
-        await self.loop.run_in_executor(None, lambda: press(self.device, self.key))
-
-
-@dataclass
-class ClapProgram:
-    finished_calibration: Optional[Notifier] = None
-    loop: Optional[asyncio.AbstractEventLoop] = None
-
-    def notify_finished_calibration(self):
-        asyncio.run_coroutine_threadsafe(self.finished_calibration.notify(), self.loop)
-
-    async def generate_regex(self, clap_notifier: Notifier) -> rex.RegularExpression:
-        self.finished_calibration = Notifier('finished_calibration')
-        self.loop = asyncio.get_event_loop()
-
-        press_ev: Callable[[str], Press] = functools.partial(Press, device='/dev/input/event3', loop=self.loop)
-
-        def wait(t):
-            return rex.Event(Wait(t))
-
-        timeout = 2
-        long_clap_delay = 0.75
-
-        def long(ev):
-            return wait(long_clap_delay) >> (
-                    ev | wait(timeout - long_clap_delay)
-            )
-
-        def short(ev):
-            return ev | wait(long_clap_delay) >> wait(timeout - long_clap_delay)
-
-        def clap(actions: set[Action] = frozenset()):
-            return clap_notifier.event_re(actions | {Print('clap')})
-
-        # .s.s.{play_pause}(.{left})*
-        play_pause_left = (
-                clap() >>
-                short(clap() >>
-                      short(
-                          clap({Print('play/pause'), press_ev('KEY_PLAYPAUSE')}) >>
-                          rex.Many(
-                              clap({Print('left'), press_ev('KEY_LEFT')})
-                          ) >>
-                          wait(timeout)
-                      )))
-        # .s.l.{left}(.{left})*
-        skip_left = (
-                clap() >>
-                short(clap() >>
-                      long(
-                          rex.Some(
-                              clap({Print('left'), press_ev('KEY_LEFT')})
-                          ) >>
-                          wait(timeout)
-                      )))
-        # .l.s.{right}(.{right})*
-        skip_right = (
-                clap() >>
-                long(clap() >>
-                     short(
-                         rex.Some(
-                             clap({Print('right'), press_ev('KEY_RIGHT')})
-                         ) >>
-                         wait(timeout)
-                     )))
-
-        whilst_calibrating = rex.Many(clap()) >> self.finished_calibration.event_re({Print('start listening!')})
-
-        return whilst_calibrating >> rex.Many(play_pause_left | skip_left | skip_right)
-
-
-def clappy(verbose: bool = False, threshold: Union[int, str] = 'auto'):
-    print('Calibrating')
-    use_settings = dataclasses.replace(settings.default_settings, threshold=threshold)
-    clap_program = ClapProgram()
-
-    clappy_sequence = ClapSequenceRegex(
-        clap_program.generate_regex,
-        settings=use_settings
-    )
+from typing import Union, Optional, TYPE_CHECKING
+
+from constants import CHANNELS, CHUNK, RELAY_PORT
+from input_devices import press, set_mic
+
+if TYPE_CHECKING:
+    from fft_backend import FFTBackend
+
+
+def clap_settings(threshold: Union[int, str], sample_rate: Optional[int], chunk: int):
+    import dataclasses
+
+    import settings
+
+    if sample_rate is None and chunk == CHUNK:
+        return dataclasses.replace(settings.default_settings, threshold=threshold)
+    return dataclasses.replace(settings.default_physical_settings,
+                               threshold=settings.scale_threshold(threshold, CHUNK ** -0.5))
+
+
+def start_metrics(metrics_port: Optional[int], metrics_log_interval: Optional[float]):
+    """
+    :return: the metrics, or None if neither sink is wanted, and the started sinks
+    """
+    from metrics import Metrics, PrometheusSink, LogSink
+
+    if metrics_port is None and metrics_log_interval is None:
+        return None, []
+    metrics = Metrics()
+    metric_sinks = []
+    if metrics_port is not None:
+        metric_sinks.append(PrometheusSink(metrics, metrics_port))
+    if metrics_log_interval is not None:
+        metric_sinks.append(LogSink(metrics, metrics_log_interval))
+    for sink in metric_sinks:
+        sink.start()
+    return metrics, metric_sinks
+
+
+def configure_detector(detector, clap_program, threshold: Union[int, str], record_dir: Optional[str], profile: bool,
+                       sample_rate: Optional[int], chunk: int, fft: Union[str, 'FFTBackend'], float32: bool, *,
+                       channels: int = CHANNELS, min_coincident_channels: int = 1, coincidence_frames: int = 1,
+                       classifier: bool = False):
+    """
+    :param fft: a backend name, or a backend to share with other detectors
+    """
+    import time
+    from threading import Thread
+
+    from audio_recorder import RingRecorder
+    import settings
+    from fft_backend import make_fft_backend
+    from settings_store import SettingsStore
+
+    detector.fft = make_fft_backend(fft, float32=float32) if isinstance(fft, str) else fft
+    detector.chunk = chunk
+    detector.sample_rate = sample_rate
+    if classifier and not profile:
+        raise ValueError('The classifier is loaded from the profile, so cannot be used with --noprofile')
+    if min_coincident_channels > channels:
+        raise ValueError(f'min_coincident_channels={min_coincident_channels} is more than the {channels} channels')
+    detector.channels = channels
+    detector.min_coincident_channels = min_coincident_channels
+    detector.coincidence_frames = coincidence_frames
+    if record_dir is not None:
+        detector.recorder = RingRecorder(record_dir)
+    if profile:
+        detector.profiles = SettingsStore()
+        detector.use_profile_classifier = classifier
+        # a threshold given here wins over the profile's
+        if threshold != 'adaptive':
+            detector.threshold_override = settings.scale_threshold(threshold, CHUNK ** -0.5)
 
     if threshold == 'auto':
+        print('Calibrating')
+
         def turn_off_auto_delayed():
             time.sleep(5)
-            clappy_sequence.clappy.auto_threshold = False
-            threshold = clappy_sequence.clappy.settings.threshold
+            detector.auto_threshold = False
+            # the learned threshold is kept now, and saved, unless the profile is changed meanwhile
+            detector.threshold_override = None
+            threshold = detector.settings.threshold
             print(f'Auto threshold tuning turned off, {threshold=}')
 
             clap_program.notify_finished_calibration()
 
         thread = Thread(target=turn_off_auto_delayed)
         thread.start()
-    else:
-        clap_program.notify_finished_calibration()
+
+
+def clappy(verbose: bool = False, threshold: Union[int, str] = 'adaptive',
+           metrics_port: Optional[int] = None, metrics_log_interval: Optional[float] = None,
+           record_dir: Optional[str] = None, profile: bool = True,
+           sample_rate: Optional[int] = None, chunk: int = CHUNK, fft: str = 'numpy', float32: bool = False,
+           channels: int = CHANNELS, min_coincident_channels: int = 1, coincidence_frames: int = 1,
+           classifier: bool = False,
+           gestures: Optional[str] = None, engine: str = 'dfa'):
+    """
+    :param threshold: a fixed threshold; 'adaptive' to follow the noise floor; or 'auto' to ratchet up on the claps
+        made in the first 5 seconds
+    :param profile: use the settings saved for the microphone, if any, instead of the defaults; reload them when the
+        file changes, and save the current settings, including a learned threshold, on exit. A ``threshold`` other
+        than 'adaptive' takes precedence over the saved one; a fixed one is used for this run only, and not saved
+    :param sample_rate: capture at this rate rather than the microphone's default; with ``chunk``, lower values cut
+        the DSP cost. The default settings are converted to match, and a fixed ``threshold`` is taken to be for
+        the default chunk size
+    :param metrics_port: serve Prometheus metrics on localhost at this port
+    :param metrics_log_interval: print a metrics summary every this many seconds
+    :param record_dir: dump the audio around each clap into this directory
+    :param fft: FFT backend: numpy, scipy, pyfftw, or auto for the fastest installed
+    :param float32: process audio in single precision
+    :param channels: capture this many channels, detecting on each
+    :param min_coincident_channels: only count a clap heard on at least this many channels, within
+        ``coincidence_frames`` frames of each other
+    :param classifier: veto claps with the classifier saved in the profile by ``calibrate --classifier``
+    :param gestures: a gesture grammar, or tables compiled from one with ``compile_gestures``, instead of the built-in
+        gestures
+    :param engine: run the gestures as a DFA, or as an NFA with 'nfa', which starts faster for large grammars
+    """
+    from clap_program import ClapProgram
+    from clap_sequence_regex import ClapSequenceRegex
+
+    clap_program = ClapProgram(calibrating=threshold == 'auto', gestures=gestures)
+    metrics, metric_sinks = start_metrics(metrics_port, metrics_log_interval)
+
+    clappy_sequence = ClapSequenceRegex(
+        clap_program.generate_regex,
+        settings=clap_settings(threshold, sample_rate, chunk),
+        metrics=metrics,
+        engine=engine
+    )
+    detector = clappy_sequence.clappy
+    configure_detector(detector, clap_program, threshold, record_dir, profile, sample_rate, chunk, fft, float32,
+                       channels=channels, min_coincident_channels=min_coincident_channels,
+                       coincidence_frames=coincidence_frames, classifier=classifier)
 
     set_mic(True)
     clappy_sequence.listen(verbose=verbose)
     set_mic(False)
 
+    if profile and detector.device_info is not None:
+        detector.save_profile()
+
+    for sink in metric_sinks:
+        sink.stop()
+
 
-def websocket():
-    key: Callable[[str], None] = functools.partial(press, '/dev/input/event3')
+def daemon(verbose: bool = False, threshold: Union[int, str] = 'adaptive',
+           websocket_url: Optional[str] = f'ws://localhost:{RELAY_PORT}/video-player',
+           metrics_port: Optional[int] = None, metrics_log_interval: Optional[float] = None,
+           record_dir: Optional[str] = None, profile: bool = True,
+           sample_rate: Optional[int] = None, chunk: int = CHUNK, fft: str = 'numpy', float32: bool = False,
+           channels: int = CHANNELS, min_coincident_channels: int = 1, coincidence_frames: int = 1,
+           classifier: bool = False,
+           dsp_process: bool = False, gestures: Optional[str] = None, engine: str = 'dfa'):
+    """
+    Clap and websocket control together, in one process on one event loop, until SIGINT or SIGTERM. Options are as
+    for ``clappy``.
 
-    class App:
-        def __init__(self):
-            self.use_space = False
+    :param websocket_url: relay to take video player commands from; None to only listen for claps
+    :param dsp_process: capture and detect claps in a separate process, so that nothing else here can starve them;
+        the threshold cannot then be 'auto', and there are no recordings or DSP metrics
+    """
+    if dsp_process and (threshold == 'auto' or record_dir is not None):
+        raise ValueError("dsp_process cannot be used with threshold='auto' or record_dir")
 
-        def play_pause(self):
-            if self.use_space:
-                key('KEY_SPACE')
-            else:
-                key('KEY_PLAYPAUSE')
+    from clap_program import ClapProgram
+    from runtime import Runtime
 
-        @staticmethod
-        def back():
-            key('KEY_LEFT')
+    websocket_listener = None
+    if websocket_url is not None:
+        from websocket_listener import WebSocketListener
 
-        @staticmethod
-        def forward():
-            key('KEY_RIGHT')
+        websocket_listener = WebSocketListener(websocket_url, read_secret(), VideoPlayerKeys().actions())
 
-        @staticmethod
-        def skip():
-            key('KEY_S')
+    clap_program = ClapProgram(calibrating=threshold == 'auto', gestures=gestures)
+    metrics, metric_sinks = start_metrics(metrics_port, metrics_log_interval)
 
-        def change_use_space(self, msg):
-            self.use_space = msg['value']
-            print(f'{self.use_space=}')
+    runtime = Runtime(
+        clap_program.generate_regex,
+        settings=clap_settings(threshold, sample_rate, chunk),
+        websocket=websocket_listener,
+        metrics=metrics,
+        dsp_process=dsp_process,
+        engine=engine
+    )
+    detector = runtime.clappy
+    configure_detector(detector, clap_program, threshold, record_dir, profile, sample_rate, chunk, fft, float32,
+                       channels=channels, min_coincident_channels=min_coincident_channels,
+                       coincidence_frames=coincidence_frames, classifier=classifier)
 
-        def auto_actions(self, *action_names):
-            return {act: getattr(self, act) for act in action_names}
+    set_mic(True)
+    runtime.run(verbose=verbose)
+    set_mic(False)
 
-        def actions(self):
-            return self.auto_actions('back', 'forward', 'skip') | {
-                'playpause': self.play_pause,
-                'use-space': self.change_use_space,
-            }
+    if profile and detector.device_info is not None:
+        detector.save_profile()
 
-    app = App()
+    for sink in metric_sinks:
+        sink.stop()
+
+
+def rooms(*devices: str, verbose: bool = False, threshold: Union[int, str] = 'adaptive', profile: bool = True,
+          sample_rate: Optional[int] = None, chunk: int = CHUNK, fft: str = 'numpy', float32: bool = False,
+          channels: int = CHANNELS, min_coincident_channels: int = 1, coincidence_frames: int = 1,
+          classifier: bool = False,
+          gestures: Optional[str] = None, engine: str = 'dfa'):
+    """
+    Clap control for several rooms from one process: one microphone per room, given by input device name, each with
+    its own copy of the gestures. Options are as for ``clappy``, except that the threshold cannot be 'auto'.
+    """
+    if not devices:
+        raise ValueError('Give the input device of each room')
+    if threshold == 'auto':
+        raise ValueError("rooms cannot use threshold='auto'")
+
+    from clap_program import ClapProgram
+    from detector_manager import DetectorManager, Room
+    from fft_backend import make_fft_backend
+
+    manager = DetectorManager(
+        [
+            Room(device_name, device_name, ClapProgram(calibrating=False, gestures=gestures).generate_regex,
+                 clap_settings(threshold, sample_rate, chunk))
+            for device_name in devices
+        ],
+        fft=make_fft_backend(fft, float32=float32),
+        engine=engine
+    )
+    for detector in manager.detectors:
+        configure_detector(detector, None, threshold, None, profile, sample_rate, chunk, manager.fft, float32,
+                           channels=channels, min_coincident_channels=min_coincident_channels,
+                           coincidence_frames=coincidence_frames, classifier=classifier)
+    manager.connect(verbose=verbose)
+
+    set_mic(True)
+    manager.listen(verbose=verbose)
+    set_mic(False)
 
+    if profile:
+        for detector in manager.detectors:
+            detector.save_profile()
+
+
+def press_key(key: str):
+    press('/dev/input/event3', key)
+
+
+class VideoPlayerKeys:
+    """
+    Websocket commands from the video player page, pressed as keys.
+    """
+
+    def __init__(self):
+        self.use_space = False
+
+    def play_pause(self):
+        if self.use_space:
+            press_key('KEY_SPACE')
+        else:
+            press_key('KEY_PLAYPAUSE')
+
+    @staticmethod
+    def back():
+        press_key('KEY_LEFT')
+
+    @staticmethod
+    def forward():
+        press_key('KEY_RIGHT')
+
+    @staticmethod
+    def skip():
+        press_key('KEY_S')
+
+    def change_use_space(self, msg):
+        self.use_space = msg['value']
+        print(f'{self.use_space=}')
+
+    def auto_actions(self, *action_names):
+        return {act: getattr(self, act) for act in action_names}
+
+    def actions(self):
+        return self.auto_actions('back', 'forward', 'skip') | {
+            'playpause': self.play_pause,
+            'use-space': self.change_use_space,
+        }
+
+
+def read_secret() -> str:
     with (Path(__file__).parent / 'secret.txt').open('r') as secret_file:
-        secret = secret_file.read().strip()
+        return secret_file.read().strip()
+
+
+def websocket(url: str = f'ws://localhost:{RELAY_PORT}/video-player', bump_url: Optional[str] = None):
+    """
+    For the old hosted relay use
+    ``--url=wss://clappy-play-pause.glitch.me/video-player --bump_url=https://clappy-play-pause.glitch.me/bump``
+    """
+    from websocket_listener import WebSocketListener
+
+    app = VideoPlayerKeys()
+
     listener = WebSocketListener(
-        "wss://clappy-play-pause.glitch.me/video-player",
-        secret,
+        url,
+        read_secret(),
         app.actions(),
-        bump_url='https://clappy-play-pause.glitch.me/bump'
+        bump_url=bump_url
     )
     listener.listen()
 
 
+def calibrate(*recordings: str, depth: int = 4, window_seconds: float = 2, save: bool = False,
+              device_name: str = 'default', sweep: bool = True, cache: bool = True, classifier: bool = False):
+    """
+    Calibrate interactively from the microphone, or from labelled recordings (each with a ``.claps`` sidecar) if any
+    are given.
+
+    :param save: save the result as the profile ``clappy`` loads for the microphone, replacing any saved settings,
+        including a threshold set earlier; by default the result is only printed
+    :param device_name: the microphone the recordings were made with
+    :param sweep: score all thresholds from one pass over the recordings; --nosweep scores each separately
+    :param cache: reuse scores from earlier runs on the same windows; --nocache scores everything afresh
+    :param classifier: also train a classifier on the same windows, to save with the profile for ``clappy
+        --classifier``
+    """
+    if classifier and not save:
+        raise ValueError('The classifier is saved with the profile, so needs --save')
+
+    import calibrate as calibration
+
+    if recordings:
+        calibration.calibrate_recordings(*recordings, depth=depth, window_seconds=window_seconds, save=save,
+                                         device_name=device_name, sweep=sweep, cache=cache, classifier=classifier)
+    else:
+        calibration.calibrate(save=save, sweep=sweep, cache=cache, classifier=classifier)
+
+
+def compile_gestures(grammar: str = 'gestures.txt', output: Optional[str] = None):
+    """
+    Compile a gesture grammar into the tables ``--gestures`` loads at startup; see ``fsm.grammar``.
+
+    :param output: by default, the grammar's path with a ``.json`` suffix
+    """
+    from fsm import grammar as gesture_grammar
+
+    output = str(Path(grammar).with_suffix('.json')) if output is None else output
+    tables = gesture_grammar.compile_grammar(Path(grammar).read_text())
+    gesture_grammar.save_tables(tables, output)
+    for rule, machine in tables['machines'].items():
+        print(f'{rule}: {len(machine["states"])} states')
+    print(f'Saved {output}')
+
+
+def relay(host: str = '0.0.0.0', port: int = RELAY_PORT):
+    from relay_server import RelayServer
+
+    RelayServer(read_secret(), host, port).run()
+
+
 if __name__ == '__main__':
+    import fire
+
     fire.Fire()
@@ -0,0 +1,163 @@
+import bisect
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+# seconds, from 100µs up to 1s
+DEFAULT_BUCKETS = (1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1)
+
+
+@dataclass
+class Counter:
+    name: str
+    help: str = ''
+    value: int = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+@dataclass
+class Histogram:
+    name: str
+    help: str = ''
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    # one count per bucket, plus one for +Inf
+    counts: list[int] = field(default_factory=list)
+    total: float = 0
+    count: int = 0
+
+    def __post_init__(self):
+        if not self.counts:
+            self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the ``q`` quantile.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """
+    Counters and histograms for the detection hot path. Instrumented code takes ``metrics: Optional[Metrics]`` and
+    skips all timing when it is ``None``, so turning metrics off costs one ``is not None`` check per site.
+    """
+
+    def __init__(self):
+        self.counters: dict[str, Counter] = {}
+        self.histograms: dict[str, Histogram] = {}
+
+    def counter(self, name: str, help: str = '') -> Counter:
+        if name not in self.counters:
+            self.counters[name] = Counter(name, help)
+        return self.counters[name]
+
+    def histogram(self, name: str, help: str = '', buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, help, buckets)
+        return self.histograms[name]
+
+    def snapshot(self) -> dict[str, dict]:
+        return {
+            'counters': {name: counter.value for name, counter in self.counters.items()},
+            'histograms': {
+                name: {
+                    'buckets': dict(zip([*histogram.buckets, float('inf')], histogram.counts)),
+                    'sum': histogram.total,
+                    'count': histogram.count,
+                }
+                for name, histogram in self.histograms.items()
+            },
+        }
+
+    def prometheus_text(self) -> str:
+        lines = []
+        for counter in list(self.counters.values()):
+            lines += [f'# HELP {counter.name} {counter.help}', f'# TYPE {counter.name} counter',
+                      f'{counter.name} {counter.value}']
+        for histogram in list(self.histograms.values()):
+            lines += [f'# HELP {histogram.name} {histogram.help}', f'# TYPE {histogram.name} histogram']
+            cumulative = 0
+            for bound, bucket_count in zip([*histogram.buckets, '+Inf'], histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'{histogram.name}_bucket{{le="{bound}"}} {cumulative}')
+            lines += [f'{histogram.name}_sum {histogram.total}', f'{histogram.name}_count {histogram.count}']
+        return '\n'.join(lines) + '\n'
+
+    def summary_line(self) -> str:
+        parts = [f'{name}={counter.value}' for name, counter in self.counters.items()]
+        parts += [
+            f'{name}[n={histogram.count} p50<={histogram.quantile(0.5):g} p99<={histogram.quantile(0.99):g}]'
+            for name, histogram in self.histograms.items()
+        ]
+        return ' '.join(parts)
+
+
+class PrometheusSink:
+    """
+    Serves ``Metrics.prometheus_text`` at ``http://host:port/metrics`` from a daemon thread.
+    """
+
+    def __init__(self, metrics: Metrics, port: int = 9464, host: str = '127.0.0.1'):
+        metrics_ref = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics_ref.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class LogSink:
+    """
+    Prints ``Metrics.summary_line`` every ``interval`` seconds from a daemon thread.
+    """
+
+    def __init__(self, metrics: Metrics, interval: float = 60):
+        self.metrics = metrics
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            print(f'[metrics {time.strftime("%H:%M:%S")}] {self.metrics.summary_line()}')
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,83 @@
+import wave
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+from constants import CHUNK, PEAK_MARGIN_FRAMES
+
+
+def read_blocks(path: str, *, block_size: int = CHUNK, channels: int = 1) -> Iterator[np.ndarray]:
+    """
+    Read a mono int16 WAV or headerless recording in blocks of ``block_size`` samples, dropping any partial last block.
+    """
+    block_bytes = block_size * channels * 2
+    if path.endswith('.wav'):
+        with wave.open(path, 'rb') as wav:
+            if wav.getsampwidth() != 2 or wav.getnchannels() != channels:
+                raise ValueError(f'{path} is not {channels} channel int16 audio')
+            while len(block := wav.readframes(block_size)) == block_bytes:
+                yield np.frombuffer(block, dtype=np.int16)
+    else:
+        with open(path, 'rb') as raw:
+            while len(block := raw.read(block_bytes)) == block_bytes:
+                yield np.frombuffer(block, dtype=np.int16)
+
+
+def read_clap_times(path: str) -> list[float]:
+    """
+    One clap time in seconds per line; blank lines and ``#`` comments are ignored.
+    """
+    with open(path, 'r') as claps_file:
+        return sorted(
+            float(line)
+            for line in (raw_line.split('#', 1)[0].strip() for raw_line in claps_file)
+            if line
+        )
+
+
+class LabelledRecording:
+    """
+    A long recording and its sidecar of clap times, cut into labelled windows for ``Calibrator.score_settings``.
+
+    Iterating reads the audio lazily, one window of chunks at a time, so recordings of any length can be scored;
+    every iteration re-reads the file. A window is labelled as containing a clap if a clap starts early enough in it
+    for the detector to report it. Windows with a clap too close to their end are skipped as ambiguous.
+    """
+
+    def __init__(self, audio_path: str, claps_path: Optional[str] = None, *, window_seconds: float = 2,
+                 sample_rate: Optional[int] = None, chunk: int = CHUNK):
+        self.audio_path = str(audio_path)
+        self.claps_path = str(Path(audio_path).with_suffix('.claps')) if claps_path is None else str(claps_path)
+
+        if self.audio_path.endswith('.wav'):
+            with wave.open(self.audio_path, 'rb') as wav:
+                self.sample_rate = wav.getframerate()
+        elif sample_rate is None:
+            raise ValueError('sample_rate is needed for a headerless recording')
+        else:
+            self.sample_rate = sample_rate
+
+        self.chunk = chunk
+        self.window_frames = max(int(window_seconds * self.sample_rate / chunk), PEAK_MARGIN_FRAMES + 2)
+        self.clap_frames = [int(t * self.sample_rate / chunk) for t in read_clap_times(self.claps_path)]
+
+    def window_label(self, start_frame: int) -> Optional[bool]:
+        end_frame = start_frame + self.window_frames
+        reportable_end = end_frame - PEAK_MARGIN_FRAMES - 1
+        claps = [frame for frame in self.clap_frames if start_frame <= frame < end_frame]
+        if any(frame >= reportable_end for frame in claps):
+            return None
+        return bool(claps)
+
+    def __iter__(self) -> Iterator[Tuple[list[np.ndarray], bool]]:
+        window: list[np.ndarray] = []
+        start_frame = 0
+        for chunk in read_blocks(self.audio_path, block_size=self.chunk):
+            window.append(chunk)
+            if len(window) == self.window_frames:
+                label = self.window_label(start_frame)
+                if label is not None:
+                    yield window, label
+                window = []
+                start_frame += self.window_frames
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+import hmac
+import json
+from dataclasses import dataclass, field
+from typing import Optional, Any
+
+import websockets
+
+from constants import RELAY_PORT as DEFAULT_PORT
+
+
+@dataclass(eq=False)
+class RelayClient:
+    ws: Any
+    channel: str
+    queue: asyncio.Queue = field(repr=False)
+
+
+class RelayServer:
+    """
+    LAN replacement for the external relay: clients connect to ``ws://host:port/<channel>``, authenticate with the
+    shared secret, and every message an authenticated client sends is forwarded to every other client on the same
+    channel.
+
+    Each client gets a bounded send queue. A client that falls ``max_queue`` messages behind is disconnected rather
+    than letting the relay buffer without bound; ``WebSocketListener`` reconnects on its own.
+    """
+
+    def __init__(self, secret: str, host: str = '0.0.0.0', port: int = DEFAULT_PORT, *,
+                 max_queue: int = 32, auth_timeout: float = 5):
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.max_queue = max_queue
+        self.auth_timeout = auth_timeout
+
+        self.channels: dict[str, set[RelayClient]] = {}
+
+    @staticmethod
+    def connection_path(ws, path: Optional[str]) -> str:
+        if path is not None:
+            return path
+        request = getattr(ws, 'request', None)
+        if request is not None:
+            return request.path
+        return ws.path
+
+    async def authenticate(self, ws) -> bool:
+        try:
+            raw_msg = await asyncio.wait_for(ws.recv(), self.auth_timeout)
+            msg = json.loads(raw_msg)
+        except (asyncio.TimeoutError, ValueError, websockets.ConnectionClosed):
+            return False
+
+        return (
+                isinstance(msg, dict)
+                and msg.get('type') == 'authenticate'
+                and isinstance(msg.get('secret'), str)
+                and hmac.compare_digest(msg['secret'].encode('utf-8'), self.secret.encode('utf-8'))
+        )
+
+    def broadcast(self, sender: RelayClient, raw_msg: str):
+        for client in list(self.channels.get(sender.channel, ())):
+            if client is sender:
+                continue
+            try:
+                client.queue.put_nowait(raw_msg)
+            except asyncio.QueueFull:
+                print(f'dropping slow client on {client.channel}')
+                self.remove(client)
+                asyncio.create_task(client.ws.close(code=1013, reason='too slow'))
+
+    def remove(self, client: RelayClient):
+        channel_clients = self.channels.get(client.channel)
+        if channel_clients is not None:
+            channel_clients.discard(client)
+            if not channel_clients:
+                del self.channels[client.channel]
+
+    async def send_queued(self, client: RelayClient):
+        while True:
+            raw_msg = await client.queue.get()
+            try:
+                await client.ws.send(raw_msg)
+            except websockets.ConnectionClosed:
+                # handle sees the close too, and says the client left
+                self.remove(client)
+                return
+
+    async def handle(self, ws, path: Optional[str] = None):
+        channel = self.connection_path(ws, path)
+
+        if not await self.authenticate(ws):
+            await ws.close(code=4001, reason='authentication failed')
+            return
+
+        client = RelayClient(ws, channel, asyncio.Queue(maxsize=self.max_queue))
+        self.channels.setdefault(channel, set()).add(client)
+        print(f'client joined {channel}, {len(self.channels[channel])} connected')
+
+        send_task = asyncio.create_task(self.send_queued(client))
+        try:
+            async for raw_msg in ws:
+                try:
+                    msg = json.loads(raw_msg)
+                except ValueError:
+                    continue
+                if isinstance(msg, dict) and msg.get('type') == 'authenticate':
+                    continue
+                self.broadcast(client, raw_msg)
+        except websockets.WebSocketException:
+            pass
+        finally:
+            self.remove(client)
+            send_task.cancel()
+            print(f'client left {channel}')
+
+    async def serve(self, stop: Optional[asyncio.Future] = None):
+        async with websockets.serve(self.handle, self.host, self.port):
+            print(f'relay listening on ws://{self.host}:{self.port}')
+            await (stop if stop is not None else asyncio.Future())
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
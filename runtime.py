@@ -0,0 +1,172 @@
+import asyncio
+import signal
+import time
+import traceback
+from typing import Callable, Optional, Awaitable, Union, TYPE_CHECKING
+
+import numpy as np
+
+from clap_detector import ClapDetector
+from fsm import notifier, regular_expressions as rex
+from fsm.bit_parallel import make_machine
+from metrics import Metrics
+from settings import Settings, PhysicalSettings, default_settings
+
+if TYPE_CHECKING:
+    from dsp_process import DetectorProcess
+    from websocket_listener import WebSocketListener
+
+
+class Runtime:
+    """
+    Clap detection, the gesture state machine and websocket control in one process, on one event loop.
+
+    Only capture runs on another thread: an executor thread blocks reading the microphone and hands each chunk to the
+    loop, which does the DSP. Claps are then notified on the loop itself, so the state machine and its actions are
+    reached without any further thread hops. SIGINT and SIGTERM shut everything down cleanly.
+
+    With ``dsp_process``, capture and detection run in a process of their own instead, out of reach of the GIL here;
+    clap events come back over a pipe, which the loop watches.
+    """
+
+    def __init__(self,
+                 generate_regex: Callable[[notifier.Notifier], Awaitable[rex.RegularExpression]],
+                 settings: Union[Settings, PhysicalSettings] = default_settings, *,
+                 websocket: Optional['WebSocketListener'] = None,
+                 metrics: Optional[Metrics] = None,
+                 max_queued_chunks: int = 16,
+                 dsp_process: bool = False,
+                 engine: str = 'dfa'):
+        """
+        :param max_queued_chunks: chunks waiting for DSP before the oldest are dropped
+        :param dsp_process: capture and detect in a separate process; see ``dsp_process.DetectorProcess``
+        :param engine: runs the gestures; see ``fsm.bit_parallel.make_machine``
+        """
+        self.clappy = ClapDetector(self.on_clap, settings=settings, metrics=None if dsp_process else metrics)
+        self.generate_regex = generate_regex
+        self.websocket = websocket
+        self.metrics = metrics
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.chunks: Optional[asyncio.Queue[np.ndarray]] = None
+        self.max_queued_chunks = max_queued_chunks
+        self.clap_notifier: Optional[notifier.Notifier] = None
+        self.stopping: Optional[asyncio.Event] = None
+        self.dsp_process = dsp_process
+        self.engine = engine
+        self.detector_process: Optional['DetectorProcess'] = None
+
+    def on_clap(self, clap_frame_number: int):
+        # called by process_chunks, so already on the loop
+        self.loop.create_task(self.clap_notifier.notify())
+
+    def enqueue_chunk(self, chunk: np.ndarray):
+        if self.chunks.full():
+            self.chunks.get_nowait()
+            if self.metrics is not None:
+                self.metrics.counter('clappy_dropped_chunks_total', 'chunks dropped from a full DSP queue').inc()
+        self.chunks.put_nowait(chunk)
+
+    def capture(self):
+        # on the executor thread
+        for chunk in self.clappy.stream():
+            self.loop.call_soon_threadsafe(self.enqueue_chunk, chunk)
+
+    def read_detector_events(self):
+        # called by the loop whenever the DSP process has sent something
+        try:
+            claps = self.detector_process.read_events()
+        except EOFError:
+            self.loop.remove_reader(self.detector_process.events.fileno())
+            return
+        for clap_frame_number in claps:
+            self.on_clap(clap_frame_number)
+
+    def start_detector_process(self, verbose: bool) -> asyncio.Future:
+        """
+        :return: completes when the DSP process exits
+        """
+        from dsp_process import DetectorProcess
+
+        self.detector_process = DetectorProcess(self.clappy, verbose=verbose)
+        self.detector_process.start()
+        self.loop.add_reader(self.detector_process.events.fileno(), self.read_detector_events)
+        return self.loop.run_in_executor(None, self.detector_process.join)
+
+    async def process_chunks(self, verbose: bool = False):
+        if self.metrics is not None:
+            dsp_time = self.metrics.histogram('clappy_frame_dsp_seconds', 'DSP time per chunk')
+
+        while True:
+            chunk = await self.chunks.get()
+            if self.metrics is None:
+                self.clappy.record_chunk(chunk)
+                self.clappy.process_frame(verbose=verbose)
+            else:
+                start = time.perf_counter()
+                self.clappy.record_chunk(chunk)
+                self.clappy.process_frame(verbose=verbose)
+                dsp_time.observe(time.perf_counter() - start)
+
+    async def run_machine(self):
+        regex = await self.generate_regex(self.clap_notifier)
+        await make_machine(regex, self.engine).run(self.metrics)
+
+    def stop(self):
+        """
+        Shut down from the loop's thread; see ``run``.
+        """
+        self.stopping.set()
+
+    async def main(self, verbose: bool = False):
+        self.loop = asyncio.get_running_loop()
+        self.chunks = asyncio.Queue(self.max_queued_chunks)
+        self.clap_notifier = notifier.Notifier('clap')
+        self.stopping = asyncio.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signal_number, self.stop)
+
+        tasks = [asyncio.create_task(self.run_machine())]
+        if self.dsp_process:
+            capture = self.start_detector_process(verbose)
+        else:
+            # before capture starts, so that a stop while the device opens is not lost
+            self.clappy.stopped.clear()
+            await self.loop.run_in_executor(None, lambda: self.clappy.connect(verbose=verbose))
+            self.clappy.frame_count = 0
+            self.clappy.last_clap = 0
+            capture = self.loop.run_in_executor(None, self.capture)
+            tasks.append(asyncio.create_task(self.process_chunks(verbose)))
+        if self.websocket is not None:
+            tasks.append(asyncio.create_task(self.websocket.run()))
+
+        stopping = asyncio.create_task(self.stopping.wait())
+        await asyncio.wait([capture, stopping, *tasks], return_when=asyncio.FIRST_COMPLETED)
+
+        # a finished service, other than by stop, has failed
+        for task in [capture, *tasks]:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                ex = task.exception()
+                traceback.print_exception(type(ex), ex, ex.__traceback__)
+
+        if self.detector_process is None:
+            self.clappy.stop()
+        else:
+            self.detector_process.stop()
+        stopping.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(capture, *tasks, return_exceptions=True)
+        if self.detector_process is not None:
+            self.loop.remove_reader(self.detector_process.events.fileno())
+            self.detector_process.close()
+
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            self.loop.remove_signal_handler(signal_number)
+        print('done')
+
+    def run(self, *, verbose: bool = False):
+        """
+        Run until SIGINT or SIGTERM, or until capture or a service fails.
+        """
+        asyncio.run(self.main(verbose))
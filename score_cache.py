@@ -0,0 +1,98 @@
+import dataclasses
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from settings import Settings
+from settings_store import plain
+
+# bump whenever a change to the detector could change a score; results of other versions are never read
+PIPELINE_VERSION = 1
+DEFAULT_SCORE_CACHE_PATH = Path(__file__).parent / 'cache' / 'scores.sqlite3'
+
+
+def settings_key(settings: Settings) -> str:
+    return repr(tuple(plain(getattr(settings, field.name)) for field in dataclasses.fields(Settings)))
+
+
+class ScoreCache:
+    """
+    Calibration results kept on disk between runs, by dataset hash (see ``Calibrator.dataset_hash``), settings and
+    ``PIPELINE_VERSION``: the score of settings, or the window peaks of settings other than the threshold (see
+    ``Calibrator.window_peaks``).
+
+    Only the ``max_entries`` most recently used results are kept. Writes are committed by ``flush``.
+    """
+
+    def __init__(self, path: str = str(DEFAULT_SCORE_CACHE_PATH), max_entries: int = 100_000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'dataset TEXT, settings TEXT, version INTEGER, kind TEXT, value BLOB, used REAL, '
+            'PRIMARY KEY (dataset, settings, version, kind))'
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, dataset: str, settings: Settings, kind: str) -> Optional[bytes]:
+        key = (dataset, settings_key(settings), PIPELINE_VERSION, kind)
+        row = self.connection.execute(
+            'SELECT value FROM results WHERE dataset = ? AND settings = ? AND version = ? AND kind = ?', key
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute(
+            'UPDATE results SET used = ? WHERE dataset = ? AND settings = ? AND version = ? AND kind = ?',
+            (time.time(), *key)
+        )
+        return row[0]
+
+    def put(self, dataset: str, settings: Settings, kind: str, value: bytes):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+            (dataset, settings_key(settings), PIPELINE_VERSION, kind, value, time.time())
+        )
+
+    def score(self, dataset: str, settings: Settings) -> Optional[float]:
+        value = self.get(dataset, settings, 'score')
+        return None if value is None else float(np.frombuffer(value, dtype=np.float64)[0])
+
+    def put_score(self, dataset: str, settings: Settings, score: float):
+        self.put(dataset, settings, 'score', np.float64(score).tobytes())
+
+    def window_peaks(self, dataset: str, settings: Settings) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        value = self.get(dataset, settings, 'peaks')
+        if value is None:
+            return None
+        # peaks as float64, then one byte per label
+        window_count = len(value) // 9
+        return (np.frombuffer(value, dtype=np.float64, count=window_count),
+                np.frombuffer(value, dtype=bool, offset=8 * window_count))
+
+    def put_window_peaks(self, dataset: str, settings: Settings, peaks: np.ndarray, labels: np.ndarray):
+        self.put(dataset, settings, 'peaks',
+                 np.asarray(peaks, dtype=np.float64).tobytes() + np.asarray(labels, dtype=bool).tobytes())
+
+    def flush(self):
+        """
+        Commit, then drop the least recently used results past ``max_entries``.
+        """
+        (count,) = self.connection.execute('SELECT COUNT(*) FROM results').fetchone()
+        if count > self.max_entries:
+            self.connection.execute(
+                'DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY used LIMIT ?)',
+                (count - self.max_entries,)
+            )
+        self.connection.commit()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
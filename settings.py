@@ -1,5 +1,7 @@
 import dataclasses
+import math
 from dataclasses import dataclass
+from typing import Union
 
 import numpy as np
 from constants import *
@@ -22,6 +24,47 @@ class Settings:
     def to_array(self):
         return np.array([getattr(self, field.name) for field in dataclasses.fields(Settings)])
 
+    def to_physical(self, sample_rate: int, chunk: int = CHUNK) -> 'PhysicalSettings':
+        bin_hz = sample_rate / chunk
+        return PhysicalSettings(
+            clap_freq_hz=self.clap_freq_index * bin_hz,
+            threshold=scale_threshold(self.threshold, 1 / math.sqrt(chunk)),
+            gaussian_laplace_seconds=self.gaussian_laplace_sigma * chunk / sample_rate,
+            freq_gaussian_hz=self.freq_gaussian_sigma * bin_hz
+        )
+
+
+def scale_threshold(threshold: Union[float, str], factor: float) -> Union[float, str]:
+    # 'auto' and 'adaptive' learn the threshold on the device, so need no scaling
+    return threshold if isinstance(threshold, str) else threshold * factor
+
+
+@dataclass(frozen=True)
+class PhysicalSettings:
+    """
+    ``Settings`` in units that do not depend on the sample rate or chunk size, so one calibration carries over to
+    other devices and chunk sizes. ``to_settings`` turns them into FFT bins and frames once the sample rate is known.
+
+    The threshold is per square root of a sample: FFT magnitudes of background noise grow with the square root of
+    the chunk size. Claps are shorter than a chunk, so this is only approximate for them; 'adaptive' is more robust
+    when changing chunk size.
+    """
+    clap_freq_hz: float
+    threshold: Union[float, str]
+    gaussian_laplace_seconds: float
+    freq_gaussian_hz: float
+
+    def to_settings(self, sample_rate: int, chunk: int = CHUNK) -> Settings:
+        if self.clap_freq_hz > sample_rate / 2:
+            raise ValueError(f'{self.clap_freq_hz:.0f}Hz claps cannot be heard when sampling at {sample_rate}Hz')
+        bin_hz = sample_rate / chunk
+        return Settings(
+            clap_freq_index=round(self.clap_freq_hz / bin_hz),
+            threshold=scale_threshold(self.threshold, math.sqrt(chunk)),
+            gaussian_laplace_sigma=self.gaussian_laplace_seconds * sample_rate / chunk,
+            freq_gaussian_sigma=self.freq_gaussian_hz / bin_hz
+        )
+
 
 default_settings = Settings(
     clap_freq_index=1655,
@@ -29,6 +72,9 @@ default_settings = Settings(
     gaussian_laplace_sigma=0.7,
     freq_gaussian_sigma=117
 )
+# the sample rate default_settings were calibrated at, with chunks of CHUNK samples
+DEFAULT_SETTINGS_SAMPLE_RATE = 44100
+default_physical_settings = default_settings.to_physical(DEFAULT_SETTINGS_SAMPLE_RATE)
 max_settings = Settings(
     clap_freq_index=CHUNK // 2 - 1,
     threshold=1000,
@@ -0,0 +1,155 @@
+import dataclasses
+import json
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional, TYPE_CHECKING
+
+from adaptive_threshold import AdaptiveThreshold
+from clap_classifier import ClapClassifier
+from constants import CHUNK
+from settings import PhysicalSettings
+
+if TYPE_CHECKING:
+    from clap_detector import ClapDetector
+
+# bump when the meaning of a saved field changes; profiles of other versions are ignored
+PROFILE_VERSION = 2
+DEFAULT_PROFILE_DIRECTORY = Path(__file__).parent / 'profiles'
+
+
+@dataclasses.dataclass(frozen=True)
+class Profile:
+    settings: PhysicalSettings
+    # the chunk size the adaptive noise estimate was learned with
+    chunk: int = CHUNK
+    # learned noise floor, when the threshold is 'adaptive'
+    adaptive_median: Optional[float] = None
+    adaptive_mad: Optional[float] = None
+    # the sample rate the adaptive noise estimate was learned at
+    sample_rate: Optional[int] = None
+    # trained by ``Calibrator.train_classifier``, on band features at this chunk size and sample rate
+    classifier: Optional[ClapClassifier] = None
+
+    def adaptive_threshold(self) -> Optional[AdaptiveThreshold]:
+        if self.adaptive_median is None or self.adaptive_mad is None:
+            return None
+        adaptive_threshold = AdaptiveThreshold()
+        adaptive_threshold.seed(self.adaptive_median, self.adaptive_mad)
+        return adaptive_threshold
+
+
+def plain(value):
+    # numpy scalars, as produced by Calibrator, are not JSON serialisable
+    return value.item() if hasattr(value, 'item') else value
+
+
+class SettingsStore:
+    """
+    Calibrated settings on disk, one JSON profile per input device. Settings are saved in physical units, so a profile
+    still applies after the sample rate or chunk size changes; only the adaptive noise estimate is tied to both.
+
+    Loads are cached by file modification time, so polling a profile for changes costs one ``stat``.
+    """
+
+    def __init__(self, directory: str = str(DEFAULT_PROFILE_DIRECTORY)):
+        self.directory = Path(directory)
+        self.cache: dict[Path, tuple[float, Optional[Profile]]] = {}
+
+    def path(self, device_name: str) -> Path:
+        path = self.directory / f'{self.slug(device_name)}.json'
+        if not path.exists():
+            # profiles used to be saved per sample rate too; the newest of those stands in until the next save
+            legacy_name = re.compile(re.escape(self.slug(device_name)) + r'-\d+\.json')
+            legacy_paths = sorted((legacy_path for legacy_path in self.directory.glob('*.json')
+                                   if legacy_name.fullmatch(legacy_path.name)),
+                                  key=lambda legacy_path: legacy_path.stat().st_mtime)
+            if legacy_paths:
+                return legacy_paths[-1]
+        return path
+
+    @staticmethod
+    def slug(device_name: str) -> str:
+        return re.sub(r'[^A-Za-z0-9]+', '-', device_name).strip('-').lower() or 'device'
+
+    def modified_time(self, device_name: str) -> Optional[float]:
+        try:
+            return self.path(device_name).stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def load(self, device_name: str) -> Optional[Profile]:
+        path = self.path(device_name)
+        mtime = self.modified_time(device_name)
+        if mtime is None:
+            return None
+        if path in self.cache and self.cache[path][0] == mtime:
+            return self.cache[path][1]
+
+        try:
+            stored = json.loads(path.read_text())
+        except json.JSONDecodeError as ex:
+            print(f'Ignoring unreadable profile {path}: {ex}')
+            return None
+        if stored.get('version') != PROFILE_VERSION:
+            print(f'Ignoring profile {path}: saved by version {stored.get("version")}')
+            profile = None
+        else:
+            profile = Profile(
+                PhysicalSettings(**stored['settings']),
+                stored['chunk'],
+                stored.get('adaptive_median'),
+                stored.get('adaptive_mad'),
+                stored.get('sample_rate'),
+                None if stored.get('classifier') is None else ClapClassifier.from_dict(stored['classifier']),
+            )
+
+        self.cache[path] = (mtime, profile)
+        return profile
+
+    def save(self, device_name: str, profile: Profile) -> Path:
+        path = self.directory / f'{self.slug(device_name)}.json'
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stored = {
+            'version': PROFILE_VERSION,
+            'device_name': device_name,
+            'sample_rate': profile.sample_rate,
+            'chunk': profile.chunk,
+            'saved': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'settings': {field.name: plain(getattr(profile.settings, field.name))
+                         for field in dataclasses.fields(PhysicalSettings)},
+            'adaptive_median': plain(profile.adaptive_median),
+            'adaptive_mad': plain(profile.adaptive_mad),
+            'classifier': None if profile.classifier is None else profile.classifier.to_dict(),
+        }
+        # write then rename, so a watcher never reads half a file
+        partial_path = path.with_suffix('.json.partial')
+        partial_path.write_text(json.dumps(stored, indent=2))
+        partial_path.replace(path)
+        return path
+
+    def watch(self, detector: 'ClapDetector', interval: float = 1) -> threading.Event:
+        """
+        Hot-swap ``detector``'s settings whenever its profile changes on disk. The detector must be connected.
+
+        :return: set it to stop watching
+        """
+        device_name = detector.device_info['name']
+        stopped = threading.Event()
+
+        def poll():
+            last_mtime = self.modified_time(device_name)
+            while not stopped.wait(interval):
+                mtime = self.modified_time(device_name)
+                if mtime is not None and mtime != last_mtime:
+                    last_mtime = mtime
+                    profile = self.load(device_name)
+                    if profile is not None:
+                        settings = detector.profile_settings(profile)
+                        print(f'Reloaded settings {settings}')
+                        detector.update_settings(settings)
+
+        threading.Thread(target=poll, daemon=True).start()
+        return stopped
+
@@ -0,0 +1,42 @@
+import pytest
+
+from benchmark import KERNEL_CHECK_SETTINGS, SAMPLE_RATE, frame_claps, kernel_claps, new_detector, synthetic_chunks
+from clap_kernel import detect_claps_python
+
+FRAME_COUNT = 400
+CHUNKS = synthetic_chunks(FRAME_COUNT, list(range(15, FRAME_COUNT - 10, 23)))
+
+
+@pytest.mark.parametrize('block_count', [1, 3])
+@pytest.mark.parametrize('settings', KERNEL_CHECK_SETTINGS, ids=str)
+def test_python_kernel_matches_numpy(settings, block_count):
+    assert kernel_claps(CHUNKS, settings, detect_claps_python, block_count) == frame_claps(CHUNKS, settings)
+
+
+@pytest.mark.parametrize('block_count', [1, 3])
+@pytest.mark.parametrize('settings', KERNEL_CHECK_SETTINGS, ids=str)
+def test_compiled_kernel_matches_numpy(settings, block_count):
+    pytest.importorskip('numba')
+    from clap_kernel import detect_claps
+
+    assert kernel_claps(CHUNKS, settings, detect_claps, block_count) == frame_claps(CHUNKS, settings)
+
+
+def test_listen_calls_on_clap_as_it_streams():
+    frames_at_clap = []
+    detector = new_detector(lambda clap_frame: frames_at_clap.append((clap_frame, detector.frame_count)), SAMPLE_RATE)
+    detector.listen(iter(CHUNKS))
+
+    # each clap is reported within one history of the frame it was heard in, not once the stream has ended
+    history_size = detector.amplitudes_history.shape[-1]
+    assert frames_at_clap
+    for clap_frame, frame_count in frames_at_clap:
+        assert clap_frame < frame_count <= clap_frame + history_size
+
+
+def test_listen_block_finds_the_same_claps_as_listen():
+    streamed, blocked = [], []
+    new_detector(streamed.append, SAMPLE_RATE).listen(iter(CHUNKS))
+    new_detector(blocked.append, SAMPLE_RATE).listen_block(CHUNKS)
+
+    assert blocked == streamed
@@ -0,0 +1,41 @@
+import pytest
+
+from clap_sequence_binary import ClapSequenceBinary, ToleranceDecoder, encode_command, rounded_ratio
+
+
+@pytest.fixture
+def binary():
+    sequence_binary = ClapSequenceBinary([lambda: None] * 7)
+    yield sequence_binary
+    sequence_binary.scheduler.close()
+
+
+def test_rounded_ratio_matches_round():
+    for numerator in range(200):
+        for denominator in range(1, 40):
+            assert rounded_ratio(numerator, denominator) == round(numerator / denominator)
+
+
+def test_half_ratios_round_to_even(binary):
+    # intervals 10, 20, 10: the last ratio is exactly a half, which rounds down to 0 and repeats bit 1
+    assert binary.decode_sequence([0, 10, 30, 40]) == 2
+
+
+@pytest.mark.parametrize('options', [1, 3, 7, 15])
+def test_tolerance_decoder_agrees_with_interval_ratios(options):
+    binary = ClapSequenceBinary([lambda: None] * options)
+    decoder = ToleranceDecoder(binary.sequence_length, options)
+    try:
+        for command_index in range(1, options + 1):
+            sequence = [10 * t for t in encode_command(command_index)]
+            assert binary.decode_sequence(sequence) == command_index
+            # long after the last clap, every longer command has missed its next clap
+            assert decoder.decide(sequence, sequence[-1] + 1000) == (True, command_index)
+    finally:
+        binary.scheduler.close()
+
+
+def test_tolerance_decoder_allows_jitter():
+    decoder = ToleranceDecoder(3, 7)
+    # command 6 is claps at 0, 1, 3 and 5 units
+    assert decoder.decide([0, 11, 29, 52], 1000) == (True, 6)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from benchmark import SAMPLE_RATE, synthetic_chunks
+from clap_detector import ClapDetector
+from detector_manager import DetectorManager, Room
+
+CLAP_FRAMES = [30, 80, 130]
+FRAME_COUNT = 180
+
+
+def interleave(*channels: list[np.ndarray]) -> list[np.ndarray]:
+    return [np.stack(chunks, axis=-1).reshape(-1) for chunks in zip(*channels)]
+
+
+def claps_heard(chunks: list[np.ndarray], channels: int, min_coincident_channels: int) -> list[int]:
+    claps = []
+    detector = ClapDetector(claps.append, channels=channels, min_coincident_channels=min_coincident_channels,
+                            sample_rate=SAMPLE_RATE)
+    detector.allocate_history()
+    detector.listen(iter(chunks))
+    return claps
+
+
+@pytest.fixture(scope='module')
+def clapping():
+    return synthetic_chunks(FRAME_COUNT, CLAP_FRAMES)
+
+
+@pytest.fixture(scope='module')
+def quiet():
+    return synthetic_chunks(FRAME_COUNT, [], seed=1)
+
+
+def test_clap_on_every_channel_is_coincident(clapping):
+    stereo = interleave(clapping, clapping)
+    assert len(claps_heard(stereo, 2, 2)) == len(CLAP_FRAMES)
+    assert claps_heard(stereo, 2, 2) == claps_heard(clapping, 1, 1)
+
+
+def test_clap_on_one_channel_needs_no_coincidence(clapping, quiet):
+    stereo = interleave(quiet, clapping)
+    assert len(claps_heard(stereo, 2, 1)) == len(CLAP_FRAMES)
+    assert claps_heard(stereo, 2, 2) == []
+
+
+def test_manager_batches_rooms_of_different_channels(clapping, quiet):
+    async def no_gestures(clap_notifier):
+        raise NotImplementedError
+
+    manager = DetectorManager([Room('stereo', 'a', no_gestures), Room('mono', 'b', no_gestures)])
+    claps = {0: [], 1: []}
+    for room_index, detector in enumerate(manager.detectors):
+        detector.on_clap = claps[room_index].append
+        detector.sample_rate = SAMPLE_RATE
+    stereo = manager.detectors[0]
+    stereo.channels = 2
+    stereo.min_coincident_channels = 2
+    for detector in manager.detectors:
+        detector.allocate_history()
+
+    for stereo_chunk, mono_chunk in zip(interleave(clapping, clapping), quiet):
+        manager.process_batch([(0, stereo_chunk), (1, mono_chunk)])
+
+    assert claps[0] == claps_heard(clapping, 1, 1)
+    assert claps[1] == []
@@ -0,0 +1,71 @@
+import heapq
+import itertools
+import time
+import traceback
+from dataclasses import dataclass, field
+from threading import Condition, Thread
+from typing import Callable, Any, Optional
+
+
+@dataclass(eq=False)
+class TimerHandle:
+    deadline: float
+    callback: Callable[[], Any] = field(repr=False)
+    cancelled: bool = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerScheduler:
+    """
+    Runs callbacks after a delay using one worker thread and a heap of deadlines, instead of one sleeping thread per
+    timer. Cancelled timers are dropped when they reach the top of the heap.
+    """
+
+    def __init__(self):
+        self.heap: list[tuple[float, int, TimerHandle]] = []
+        self.condition = Condition()
+        self.counter = itertools.count()
+        self.worker: Optional[Thread] = None
+        self.closed = False
+
+    def schedule(self, delay: float, callback: Callable[[], Any]) -> TimerHandle:
+        handle = TimerHandle(time.monotonic() + delay, callback)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('TimerScheduler is closed')
+            if self.worker is None:
+                self.worker = Thread(target=self.run, daemon=True)
+                self.worker.start()
+            heapq.heappush(self.heap, (handle.deadline, next(self.counter), handle))
+            self.condition.notify()
+        return handle
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.closed:
+                        return
+                    while self.heap and self.heap[0][2].cancelled:
+                        heapq.heappop(self.heap)
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    remaining = self.heap[0][0] - time.monotonic()
+                    if remaining <= 0:
+                        _, _, handle = heapq.heappop(self.heap)
+                        break
+                    self.condition.wait(remaining)
+
+            try:
+                handle.callback()
+            except Exception as ex:
+                traceback.print_exception(ex, ex, ex.__traceback__)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.heap.clear()
+            self.condition.notify()
@@ -8,7 +8,8 @@ import threading
 import websockets
 import inspect
 import json
-import aiohttp
+
+RECONNECT_SECONDS = 5
 
 
 class WebSocketListener:
@@ -23,31 +24,54 @@ class WebSocketListener:
         self.async_loop: Optional[asyncio.AbstractEventLoop] = None
         self.termination_notifier: Optional[asyncio.Lock] = None
 
-    async def bump_the_server(self, session: aiohttp.ClientSession):
+    async def bump_the_server(self):
         if self.bump_url is not None:
-            while True:
-                async with session.get(self.bump_url) as response:
-                    await response.text()
-                await asyncio.sleep(60 * 5)
+            # only needed for the old hosted relay, so not imported otherwise
+            import aiohttp
+
+            async with aiohttp.ClientSession() as session:
+                while True:
+                    async with session.get(self.bump_url) as response:
+                        await response.text()
+                    await asyncio.sleep(60 * 5)
 
     async def websocket_listen(self, ws):
+        loop = asyncio.get_running_loop()
         async for raw_msg in ws:
-            msg = json.loads(raw_msg)
+            # a bad message is skipped, rather than ending the listener and, in the daemon, everything else
+            try:
+                msg = json.loads(raw_msg)
+            except ValueError:
+                print(f'ignoring malformed message {raw_msg!r}')
+                continue
+            if not isinstance(msg, dict):
+                print(f'ignoring message {msg!r}')
+                continue
 
             if 'type' in msg and msg['type'] in self.actions:
                 action = self.actions[msg['type']]
                 action_sig = inspect.signature(action)
-                if len(action_sig.parameters) == 1:
-                    action(msg)
-                else:
-                    action()
+                # actions press keys in a subprocess, which would hold up everything else on the loop
+                try:
+                    if len(action_sig.parameters) == 1:
+                        await loop.run_in_executor(None, action, msg)
+                    else:
+                        await loop.run_in_executor(None, action)
+                except Exception:
+                    print(f'command {msg["type"]!r} failed on message {msg}')
+                    traceback.print_exc()
             else:
                 if 'type' in msg:
                     print(f'unrecognised command {repr(msg["type"])} in message {msg}')
 
     async def restartable_websocket_tasks(self):
         while True:
-            ws = await websockets.connect(self.url)
+            try:
+                ws = await websockets.connect(self.url)
+            except (OSError, websockets.WebSocketException) as ex:
+                print(f'connecting failed ({ex}), retrying in {RECONNECT_SECONDS}s')
+                await asyncio.sleep(RECONNECT_SECONDS)
+                continue
             print('connected')
             try:
                 await ws.send(json.dumps({'type': 'authenticate', 'secret': self.secret}))
@@ -60,6 +84,20 @@ class WebSocketListener:
 
             await ws.close()
 
+    async def run(self):
+        """
+        Listen on the running event loop until cancelled.
+        """
+        tasks = [
+            asyncio.create_task(self.restartable_websocket_tasks()),
+            asyncio.create_task(self.bump_the_server())
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
     def run_websocket_listen(self):
         self.async_loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.async_loop)
@@ -68,23 +106,23 @@ class WebSocketListener:
 
         async def run_websocket_listen_terminable():
             await self.termination_notifier.acquire()
-            async with aiohttp.ClientSession() as session:
-                ws_task = asyncio.create_task(self.restartable_websocket_tasks())
-                bump_task = asyncio.create_task(self.bump_the_server(session))
-
-                await asyncio.wait([
-                    asyncio.create_task(asyncio.wait([
-                        ws_task,
-                        bump_task
-                    ])),
-                    asyncio.create_task(self.termination_notifier.acquire())
-                ],
-                    return_when=asyncio.FIRST_COMPLETED
-                )
+            ws_task = asyncio.create_task(self.restartable_websocket_tasks())
+            bump_task = asyncio.create_task(self.bump_the_server())
+
+            await asyncio.wait([
+                asyncio.create_task(asyncio.wait([
+                    ws_task,
+                    bump_task
+                ])),
+                asyncio.create_task(self.termination_notifier.acquire())
+            ],
+                return_when=asyncio.FIRST_COMPLETED
+            )
             for task in (ws_task, bump_task):
                 if task.done():
                     ex = task.exception()
-                    traceback.print_exception(ex, ex, ex.__traceback__)
+                    if ex is not None:
+                        traceback.print_exception(ex, ex, ex.__traceback__)
                 else:
                     task.cancel()
             await asyncio.wait([